@@ -1,14 +1,15 @@
 from typing import cast
 from planners.acyclic_planner import AcyclicPlanner, verbose_levels
+from planners.plan_optimizer import optimize_plan
 from eas.eas_parser import parse_configs
-from eas.block_domain import  Object, domain, create_domain_transition_graph
+from eas.block_domain import  Object, create_block_domain, create_domain_transition_graph
 from dispatcher.dispatcher import CommandDispatcher
 
 def main():
     config_name = "stacked"
     problem_config_path = "config/problem_configs/"
 
-    block_domain = parse_configs(domain, config_name, problem_config_path)
+    block_domain = parse_configs(create_block_domain(), config_name, problem_config_path)
     dtg = create_domain_transition_graph(block_domain)
 
     ap = AcyclicPlanner(block_domain, dtg, verbose_levels.INFO)
@@ -18,6 +19,8 @@ def main():
 
     if plan:
         print(f"Plan found 😄! Total number of goal states: {len(ap.goal_linked_states)}")
+        plan, report = optimize_plan(plan, block_domain)
+        print(report)
         # cd = CommandDispatcher(block_domain)
         # cd.initialize_objects()
         # cd.run_simulation(plan)
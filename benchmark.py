@@ -0,0 +1,342 @@
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from dataclasses import dataclass, asdict, fields
+from typing import Dict, List, Tuple, cast
+from scipy.spatial import cKDTree
+
+from eas.EAS import Domain
+from eas.block_domain import Robot, Pose, Object, create_goal_nodes, create_block_domain, create_domain_transition_graph
+from eas.eas_parser import parse_configs
+from eas.problem_format import PROBLEM_FILE, save_binary_problem
+from planners.basic_planner import solve_dtg_basic, PlanNotFound
+from planners.acyclic_planner import AcyclicPlanner
+from mapping.oc_map import OccupancyGridMap
+from mapping.path_planner import grid_astar
+
+PLANNERS = ("basic", "acyclic", "astar")
+
+# Scaling sweep: one generated scene per (number of stacks, stack height), with a goal for every other stack.
+# Stacks need a height of at least 3, the block domain cannot unstack a single block from a static base.
+GENERATED_STACKS = (2, 4, 8, 16)
+GENERATED_HEIGHTS = (3, 4)
+GENERATED_SEED = 0
+
+MIN_TIME_DELTA = 0.05 # Seconds, smaller wall time differences are noise and never count as a regression
+MIN_MEMORY_DELTA = 1 << 20 # Bytes, the same for peak memory
+RESULT_POLL_INTERVAL = 0.1 # Seconds between checks whether a benchmark process is still alive
+
+@dataclass
+class BenchmarkResult:
+    config_name: str
+    planner: str
+    status: str = "ok" # ok, no_plan, timeout or error
+    num_blocks: int | None = None
+    num_poses: int | None = None
+    wall_time: float | None = None
+    expanded: int | None = None
+    generated: int | None = None
+    plan_length: int | None = None
+    peak_memory: int | None = None # Bytes, as seen by tracemalloc
+    error: str | None = None
+
+# Written into the JSON output next to the results
+FIELD_DESCRIPTIONS = {
+    'config_name': "problem config, generated_s<stacks>_h<height>_g<goals> for the scaling sweep",
+    'planner': "basic (solve_dtg_basic), acyclic (AcyclicPlanner.run_acyclic_planner) or astar (grid_astar)",
+    'status': "ok, no_plan, timeout, or error when the run raised or its process died",
+    'num_blocks': "blocks in the problem, the problem size to plot against",
+    'num_poses': "poses in the problem",
+    'wall_time': "seconds spent in the planner, with tracemalloc running, None unless the run finished",
+    'expanded': "states whose successors were generated. None for basic, which scores operators in bulk "
+                "without expanding states, and for astar, which does not report its expansions",
+    'generated': "states created by the search, None for basic and astar for the same reasons",
+    'plan_length': "actions in the plan, for astar the total number of path points",
+    'peak_memory': "tracemalloc peak in bytes during the planner, None unless the run finished",
+    'error': "exception, exit code or PlanNotFound message of a failed run",
+}
+
+def generate_scene(num_stacks: int, stack_height: int, num_goals: int, seed: int) -> Tuple[Dict, Dict]:
+    """
+        Stacks on a 4 m lattice, far enough apart that their inflated footprints leave free space between them,
+        and a robot in front of them. Like the hand-written configs every stack stands on a static block.
+        The goals move the top blocks of randomly chosen stacks to free ground positions. Poses only exist where
+        blocks start or end, so a block lower in a stack would have nowhere to put the blocks above it.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(num_stacks)))
+
+    init_config: Dict[str, Dict] = {}
+    top_names = []
+    for stack in range(num_stacks):
+        x, y = float(stack // side) * 4.0, float(stack % side) * 4.0
+        for level in range(stack_height):
+            name = f"block{len(init_config) + 1}"
+            init_config[name] = {'type': "dynamic" if level > 0 else "static", 'position': [x, y, 0.5 + level], 'orientation': [0.0, 0.0, 0.0],
+                                 'color': rng.random(3).round(2).tolist(), 'size': 1.0}
+        top_names.append(name)
+
+    init_config['robot'] = {'type': "robot", 'position': [-4.0, -4.0, 0.5], 'orientation': [0.0, 0.0, 0.0]}
+
+    goal_config = {}
+    for goal_id, name in enumerate(rng.choice(top_names, size=num_goals, replace=False).tolist()):
+        goal_config[name] = {'position': [-4.0 - 4.0 * goal_id, 4.0 * side + 2.0, 0.5], 'orientation': [0.0, 0.0, 0.0]}
+
+    return init_config, goal_config
+
+def write_generated_scenes(problem_config_path: str, stacks: List[int], heights: List[int], seed: int = GENERATED_SEED) -> List[str]:
+    """
+        One scene per (number of stacks, stack height), smallest first, written next to each other as problem.npz files.
+    """
+    config_names = []
+    for num_stacks in sorted(stacks):
+        for stack_height in sorted(heights):
+            num_goals = max(1, num_stacks // 2)
+            config_name = f"generated_s{num_stacks}_h{stack_height}_g{num_goals}"
+            os.makedirs(os.path.join(problem_config_path, config_name), exist_ok=True)
+
+            init_config, goal_config = generate_scene(num_stacks, stack_height, num_goals, seed)
+            save_binary_problem(init_config, goal_config, os.path.join(problem_config_path, config_name, PROBLEM_FILE))
+            config_names.append(config_name)
+
+    return config_names
+
+def find_configs(problem_config_path: str) -> List[str]:
+    return sorted(entry for entry in os.listdir(problem_config_path)
+                  if os.path.exists(os.path.join(problem_config_path, entry, "init.yaml"))
+                  or os.path.exists(os.path.join(problem_config_path, entry, PROBLEM_FILE)))
+
+def load_problem(config_name: str, problem_config_path: str, result: BenchmarkResult) -> Domain:
+    domain = parse_configs(create_block_domain(), config_name, problem_config_path, verbose=False)
+    result.num_blocks = len(domain.things.get(Object, []))
+    result.num_poses = len(domain.things.get(Pose, []))
+    return domain
+
+def run_basic(config_name: str, problem_config_path: str, result: BenchmarkResult) -> None:
+    """
+        The greedy planner scores operators in bulk instead of expanding states, so expanded and generated stay None.
+    """
+    domain = load_problem(config_name, problem_config_path, result)
+    dtg = create_domain_transition_graph(domain)
+    goal_nodes = create_goal_nodes(domain, dtg)
+
+    with measure(result):
+        try:
+            plan = solve_dtg_basic(goal_nodes, dtg, domain)
+            result.plan_length = len(plan)
+        except PlanNotFound as e:
+            result.status = "no_plan"
+            result.error = str(e)
+
+def run_acyclic(config_name: str, problem_config_path: str, result: BenchmarkResult) -> None:
+    domain = load_problem(config_name, problem_config_path, result)
+    dtg = create_domain_transition_graph(domain)
+    ap = AcyclicPlanner(domain, dtg)
+
+    with measure(result):
+        ap.run_acyclic_planner()
+        plan = ap.retrace_action_sequence_back_to_root()
+
+    # Every state except the goal states gets its branches expanded
+    result.generated = ap.state_counter
+    result.expanded = ap.state_counter + 1 - len(ap.goal_linked_states)
+    result.plan_length = len(plan)
+    if not plan:
+        result.status = "no_plan"
+
+def run_astar(config_name: str, problem_config_path: str, result: BenchmarkResult) -> None:
+    """
+        One grid_astar query from the robot to every ground position that holds a pose. Poses sit inside inflated
+        block footprints, so queries start and end at the free cell nearest to each position.
+        The plan length is the total number of path points and unreachable queries are counted as no_plan.
+        grid_astar does not report its expansions, so expanded and generated stay None.
+    """
+    domain = load_problem(config_name, problem_config_path, result)
+    ocm = OccupancyGridMap(domain)
+    ocm.create_occupancy_grid_map()
+
+    robot = cast(Robot, domain.things[Robot][0])
+    poses = cast(List[Pose], domain.things[Pose])
+    positions = np.unique(np.round([pose.pos[:2] for pose in poses], 3), axis=0)
+
+    free_points = ocm.cell_to_world(np.flatnonzero(ocm.oc_grid == 0))
+    _, nearest = cKDTree(free_points).query(np.vstack([robot.at.pos[:2], positions]))
+    start, *goals = [tuple(point) for point in free_points[nearest]]
+
+    with measure(result):
+        paths = [grid_astar(ocm, start, goal) for goal in goals]
+
+    result.plan_length = sum(len(path) for path in paths)
+    if any(not len(path) for path in paths):
+        result.status = "no_plan"
+
+RUNNERS = {"basic": run_basic, "acyclic": run_acyclic, "astar": run_astar}
+
+@contextlib.contextmanager
+def measure(result: BenchmarkResult):
+    """
+        Wall time and tracemalloc peak of the block. Both are measured with tracemalloc running,
+        so times are comparable between runs but higher than without it.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        result.wall_time = time.perf_counter() - start
+        result.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+def benchmark_worker(planner: str, config_name: str, problem_config_path: str, results: multiprocessing.Queue) -> None:
+    result = BenchmarkResult(config_name=config_name, planner=planner)
+
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            RUNNERS[planner](config_name, problem_config_path, result)
+    except Exception as e:
+        result.status = "error"
+        result.error = f"{type(e).__name__}: {e}"
+
+    results.put(result)
+
+def run_benchmark(planner: str, config_name: str, problem_config_path: str, timeout: float) -> BenchmarkResult:
+    """
+        Every run gets its own process, so tracemalloc peaks and module level caches do not leak between runs
+        and a planner that does not finish in time can be killed. A process that dies without a result,
+        for example killed for running out of memory, is reported as an error with its exit code.
+    """
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=benchmark_worker, args=(planner, config_name, problem_config_path, results))
+    process.start()
+
+    deadline = time.monotonic() + timeout
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=RESULT_POLL_INTERVAL)
+        except queue.Empty:
+            if not process.is_alive():
+                try:
+                    # The result may still be in flight from a process that just exited
+                    result = results.get(timeout=RESULT_POLL_INTERVAL)
+                except queue.Empty:
+                    result = BenchmarkResult(config_name=config_name, planner=planner, status="error",
+                                             error=f"Benchmark process exited with code {process.exitcode}")
+            elif time.monotonic() > deadline:
+                result = BenchmarkResult(config_name=config_name, planner=planner, status="timeout")
+                process.terminate()
+
+    process.join()
+
+    if result.num_blocks is None:
+        # Runs that did not get as far as loading the problem still need its size for the scaling curves
+        with contextlib.suppress(Exception), open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            load_problem(config_name, problem_config_path, result)
+
+    return result
+
+def write_results(results: List[BenchmarkResult], output: str) -> None:
+    with open(f"{output}.json", 'w') as f:
+        json.dump({'fields': FIELD_DESCRIPTIONS, 'results': [asdict(result) for result in results]}, f, indent=2)
+
+    with open(f"{output}.csv", 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=[field.name for field in fields(BenchmarkResult)])
+        writer.writeheader()
+        writer.writerows(asdict(result) for result in results)
+
+def load_results(file_path: str) -> List[BenchmarkResult]:
+    with open(file_path, 'r') as f:
+        data = json.load(f)
+
+    # Older result files are a bare list of results
+    entries = data['results'] if isinstance(data, dict) else data
+    return [BenchmarkResult(**entry) for entry in entries]
+
+def find_regressions(results: List[BenchmarkResult], baseline: List[BenchmarkResult], threshold: float) -> List[str]:
+    """
+        A run regresses when it stops succeeding, or when its wall time, peak memory or plan length grows by more
+        than threshold (0.25 is 25 %) over the baseline. Expanded and generated states are deterministic, so any growth
+        past the threshold counts for them. Runs missing from either side are ignored.
+    """
+    baseline_runs = {(result.config_name, result.planner): result for result in baseline}
+    regressions = []
+
+    for result in results:
+        base = baseline_runs.get((result.config_name, result.planner))
+        if base is None:
+            continue
+
+        name = f"{result.config_name}/{result.planner}"
+        if base.status == "ok" and result.status != "ok":
+            regressions.append(f"{name}: status {base.status} -> {result.status}")
+            continue
+        if result.status != "ok":
+            continue
+
+        for metric, min_delta in [("wall_time", MIN_TIME_DELTA), ("peak_memory", MIN_MEMORY_DELTA),
+                                  ("plan_length", 0), ("expanded", 0), ("generated", 0)]:
+            old, new = getattr(base, metric), getattr(result, metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1.0 + threshold) and new - old > min_delta:
+                regressions.append(f"{name}: {metric} {old:.6g} -> {new:.6g}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the planners and the grid A* over the problem configs.")
+    parser.add_argument("--path", default="config/problem_configs/", help="problem config directory")
+    parser.add_argument("--planners", nargs="+", choices=PLANNERS, default=list(PLANNERS))
+    parser.add_argument("--configs", nargs="+", help="config names, all configs under --path by default")
+    parser.add_argument("--no-generated", action="store_true", help="skip the generated scenes")
+    parser.add_argument("--stacks", nargs="+", type=int, default=list(GENERATED_STACKS), help="stack counts of the scaling sweep")
+    parser.add_argument("--heights", nargs="+", type=int, default=list(GENERATED_HEIGHTS), help="stack heights of the scaling sweep, at least 3")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds per run")
+    parser.add_argument("--output", default="benchmark_results", help="writes <output>.json and <output>.csv")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative growth over the baseline")
+    args = parser.parse_args()
+
+    jobs = [(config_name, args.path) for config_name in (args.configs or find_configs(args.path))]
+
+    with tempfile.TemporaryDirectory() as generated_path:
+        if not args.no_generated:
+            jobs += [(config_name, generated_path) for config_name in write_generated_scenes(generated_path, args.stacks, args.heights)]
+
+        results = []
+        for config_name, problem_config_path in jobs:
+            for planner in args.planners:
+                result = run_benchmark(planner, config_name, problem_config_path, args.timeout)
+                results.append(result)
+                wall_time = "-" if result.wall_time is None else f"{result.wall_time:.3f}s"
+                peak_memory = "-" if result.peak_memory is None else f"{result.peak_memory / 1e6:.2f} MB"
+                print(f"{config_name:<24} {planner:<8} {result.num_blocks} blocks {result.status:<8} {wall_time:>9} "
+                      f"expanded {result.expanded} generated {result.generated} plan {result.plan_length} "
+                      f"peak {peak_memory}")
+
+    write_results(results, args.output)
+    print(f"Wrote {args.output}.json and {args.output}.csv")
+
+    if args.baseline is None:
+        return
+
+    regressions = find_regressions(results, load_results(args.baseline), args.threshold)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
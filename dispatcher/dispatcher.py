@@ -1,3 +1,5 @@
+import math
+
 from typing import List, Dict, Tuple, cast
 from itertools import cycle
 from eas.EAS import Action, Domain
@@ -7,29 +9,57 @@ import pybullet as p
 import time
 import pybullet_data
 
+SIM_TIME_STEP = 1./240.
+SETTLE_VELOCITY = 1e-3 # Linear and angular speed below which a body counts as at rest
+MAX_SETTLE_STEPS = 2400
+COMMAND_TOLERANCE = 0.25 # Horizontal distance from its target within which a moved or placed body counts as arrived
+PARK_POSITION = (0.0, 0.0, -50.0) # Picked bodies wait below the plane, frozen, until they are placed again
+
+BodyPose = Tuple[Tuple[float, float, float], Tuple[float, float, float, float]] # position, orientation quaternion
+
 class CommandDispatcher:
-    def __init__(self, domain: Domain) -> None:
+    def __init__(self, domain: Domain, headless: bool = False) -> None:
+        self.default_orientation = p.getQuaternionFromEuler([0, 0, 0])
+        self.entity_urdf_dict = {"block": "cube.urdf", "robot": "r2d2.urdf"}
+        self.set_domain(domain)
+
+        # DIRECT runs without a window and without real-time pacing, so plans execute as fast as pybullet steps
+        self.headless = headless
+        self.physicsClient = p.connect(p.DIRECT if headless else p.GUI)
+        self.load_plane()
+
+        self.robot_wheel_joints = {2: 'right_front_wheel_joint',
+                                   3: 'right_back_wheel_joint',
+                                   6: 'left_front_wheel_joint',
+                                   7: 'left_back_wheel_joints'}
+
+    def set_domain(self, domain: Domain) -> None:
         self.objects = []
         self.things = domain.things
         self.name_things = domain.name_things
         self.init_states = domain.states[0]
         self.positions = domain.things.get(Pose, [])
-        self.default_orientation = p.getQuaternionFromEuler([0, 0, 0])
 
-        self.entity_urdf_dict = {"block": "cube.urdf", "robot": "r2d2.urdf"}
         self.object_entity_dict = {}
         self.entity_ids = []
+        self.parked_masses: Dict[int, float] = {} # parked body id -> mass to restore when it is placed
+        self.saved_state_id = -1
+        self.saved_parked_masses: Dict[int, float] = {}
 
-        self.physicsClient = p.connect(p.GUI)
+    def load_plane(self) -> None:
+        p.setAdditionalSearchPath(pybullet_data.getDataPath(), physicsClientId=self.physicsClient)
+        p.setGravity(0, 0, -9.81, physicsClientId=self.physicsClient)
+        p.loadURDF("plane.urdf", physicsClientId=self.physicsClient)
 
-        p.setAdditionalSearchPath(pybullet_data.getDataPath())
-        p.setGravity(0, 0, -9.81)
-        p.loadURDF("plane.urdf")
-
-        self.robot_wheel_joints = {2: 'right_front_wheel_joint',
-                                   3: 'right_back_wheel_joint',
-                                   6: 'left_front_wheel_joint',
-                                   7: 'left_back_wheel_joints'}
+    def load_domain(self, domain: Domain) -> None:
+        """
+            Empty the simulation and load the objects of another domain, reusing the physics client.
+            Saved states belong to the old world and are dropped.
+        """
+        p.resetSimulation(physicsClientId=self.physicsClient)
+        self.set_domain(domain)
+        self.load_plane()
+        self.initialize_objects()
 
     def initialize_objects(self) -> None:
         for state_name, state_val in self.init_states.items():
@@ -41,18 +71,25 @@ class CommandDispatcher:
 
                 self.objects.append(obj)
 
-                if obj_name.startswith("block"):
-                    urdf_key = "block"
-                else:
-                    urdf_key = obj_name
+                self.load_body(obj_name, pos)
+
+    def load_body(self, obj_name: str, pos: Tuple[float, float, float] | List[float]) -> int:
+        """
+            Load the URDF of an object once. Afterwards commands only move, park and unpark the body.
+        """
+        urdf_key = "block" if obj_name.startswith("block") else obj_name
 
-                entity_id = p.loadURDF(self.entity_urdf_dict[urdf_key], pos, self.default_orientation)
-                self.entity_ids.append(entity_id)
-                self.object_entity_dict[obj_name] = entity_id
+        entity_id = p.loadURDF(self.entity_urdf_dict[urdf_key], pos, self.default_orientation, physicsClientId=self.physicsClient)
+        self.entity_ids.append(entity_id)
+        self.object_entity_dict[obj_name] = entity_id
+        return entity_id
+
+    def run_simulation(self, commands: List[Tuple[str, List[str]]] | List[Action], duration: int = 0) -> Dict[str, BodyPose] | None:
+        if self.headless:
+            return self.run_headless(commands)
 
-    def run_simulation(self, commands: List[Tuple[str, List[str]]] | List[Action], duration: int = 0) -> None:
         for entity in self.entity_ids:
-            pos, orn = p.getBasePositionAndOrientation(entity)
+            pos, orn = p.getBasePositionAndOrientation(entity, physicsClientId=self.physicsClient)
             print(self.objects[entity-1], pos, orn)
 
         time.sleep(2.0)
@@ -70,8 +107,8 @@ class CommandDispatcher:
                 # mode = p.VELOCITY_CONTROL
                 # p.setJointMotorControlArray(rob_entity_id, jointIndices=[2, 3, 6, 7], controlMode=mode, targetVelocities=[10.0, 10.0, 10.0, 10.0])
 
-                p.stepSimulation()
-                time.sleep(1./240.)
+                p.stepSimulation(physicsClientId=self.physicsClient)
+                time.sleep(SIM_TIME_STEP)
         else:
             for _ in range(duration):
                 if cmd_index < len(commands):
@@ -79,10 +116,114 @@ class CommandDispatcher:
                     self.execute_command(cmd, args)
                 cmd_index += 1
 
-                p.stepSimulation()
-                time.sleep(1./240.)
+                p.stepSimulation(physicsClientId=self.physicsClient)
+                time.sleep(SIM_TIME_STEP)
+
+        p.disconnect(physicsClientId=self.physicsClient)
+
+    def run_headless(self, commands: List[Tuple[str, List[str]]] | List[Action], max_settle_steps: int = MAX_SETTLE_STEPS) -> Dict[str, BodyPose]:
+        """
+            Execute the commands one per simulation step without sleeping, then keep stepping until every body
+            is at rest or max_settle_steps have passed. Returns the final pose of every body still in the world.
+            The connection stays open, call close() when done.
+        """
+        for cmd, args in commands:
+            self.execute_command(cmd, args)
+            p.stepSimulation(physicsClientId=self.physicsClient)
+
+        for _ in range(max_settle_steps):
+            if self.is_settled():
+                break
+            p.stepSimulation(physicsClientId=self.physicsClient)
+
+        return self.body_poses()
+
+    def is_settled(self) -> bool:
+        for entity_id in self.entity_ids:
+            if entity_id in self.parked_masses:
+                continue
+            linear, angular = p.getBaseVelocity(entity_id, physicsClientId=self.physicsClient)
+            if max(map(abs, linear)) > SETTLE_VELOCITY or max(map(abs, angular)) > SETTLE_VELOCITY:
+                return False
 
-        p.disconnect()
+        return True
+
+    def body_poses(self) -> Dict[str, BodyPose]:
+        poses = {}
+        for obj_name, entity_id in self.object_entity_dict.items():
+            if entity_id not in self.parked_masses:
+                pos, orn = p.getBasePositionAndOrientation(entity_id, physicsClientId=self.physicsClient)
+                poses[obj_name] = (tuple(pos), tuple(orn))
+
+        return poses
+
+    def save_world(self) -> int:
+        """
+            Snapshot the simulation in memory, so the same world can be reset for another run without reloading URDFs.
+        """
+        self.saved_state_id = p.saveState(physicsClientId=self.physicsClient)
+        self.saved_parked_masses = dict(self.parked_masses)
+        return self.saved_state_id
+
+    def restore_world(self) -> None:
+        # saveState does not cover dynamics parameters, so masses changed by picks are restored separately
+        for entity_id, mass in self.parked_masses.items():
+            if entity_id not in self.saved_parked_masses:
+                p.changeDynamics(entity_id, -1, mass=mass, physicsClientId=self.physicsClient)
+
+        for entity_id in self.saved_parked_masses:
+            if entity_id not in self.parked_masses:
+                p.changeDynamics(entity_id, -1, mass=0, physicsClientId=self.physicsClient)
+
+        p.restoreState(self.saved_state_id, physicsClientId=self.physicsClient)
+        self.parked_masses = dict(self.saved_parked_masses)
+
+    def close(self) -> None:
+        if p.isConnected(physicsClientId=self.physicsClient):
+            p.disconnect(physicsClientId=self.physicsClient)
+
+    def dispatch(self, command: str, args: List[str], steps: int = 1) -> str | None:
+        """
+            Execute a single command and step the world, pacing the steps in real time in GUI mode.
+            Returns the reason the command failed, or None if the moved or placed body reached its target.
+        """
+        if command not in ("move", "pick", "place", "unstack", "stack"):
+            return f"Unknown command: {command}"
+
+        try:
+            self.execute_command(command, args)
+        except KeyError as e:
+            return f"Unknown body or pose {e} in {command} {args}"
+
+        for _ in range(steps):
+            p.stepSimulation(physicsClientId=self.physicsClient)
+            if not self.headless:
+                time.sleep(SIM_TIME_STEP)
+
+        return self.check_command(command, args)
+
+    def check_command(self, command: str, args: List[str]) -> str | None:
+        match command:
+            case "move":
+                name, target = args[0], self.robot_target_position(args[2])
+            case "place" | "stack":
+                name, target = args[1], list(cast(Pose, self.name_things[args[2]]).pos)
+            case _:
+                return None
+
+        pos, _ = p.getBasePositionAndOrientation(self.object_entity_dict[name], physicsClientId=self.physicsClient)
+        error = math.dist(pos[:2], target[:2])
+        if error > COMMAND_TOLERANCE:
+            return f"{name} is {error:.2f} away from {args[2]} after {command}"
+
+        return None
+
+    def robot_target_position(self, pose_name: str) -> List[float]:
+        # The robot stops next to the pose rather than on it
+        target_pos = list(cast(Pose, self.name_things[pose_name]).pos)
+        target_pos[0] += 1.2
+        target_pos[2] = 0.5
+        return target_pos
 
     def execute_command(self, command: str, args: List[str]):
         match command:
@@ -102,21 +243,19 @@ class CommandDispatcher:
     def move_action(self, args: List[str]):
         print(f"Move action executed with args: {args}")
         entity_id = self.object_entity_dict[args[0]]
-        target_pos = list(cast(Pose, self.name_things.get(args[2])).pos)
-        target_pos[0] += 1.2
-        target_pos[2] = 0.5
+        target_pos = self.robot_target_position(args[2])
 
-        p.removeBody(entity_id)
-        new_entity_id = p.loadURDF(self.entity_urdf_dict[args[0]], target_pos, self.default_orientation)
-        self.entity_ids.append(new_entity_id)
-        self.entity_ids.remove(entity_id)
-        self.object_entity_dict[args[0]] = new_entity_id
+        self.reset_body(entity_id, target_pos)
 
     def pick_action(self, args: List[str]):
         print(f"Pick action executed with args: {args}")
         entity_id = self.object_entity_dict[args[1]]
-        p.removeBody(entity_id)
-        self.entity_ids.remove(entity_id)
+
+        # Mass 0 makes the body static, so it stays parked instead of falling
+        mass = p.getDynamicsInfo(entity_id, -1, physicsClientId=self.physicsClient)[0]
+        p.changeDynamics(entity_id, -1, mass=0, physicsClientId=self.physicsClient)
+        self.reset_body(entity_id, PARK_POSITION)
+        self.parked_masses[entity_id] = mass
 
     def place_action(self, args: List[str]):
         print(f"Place action executed with args: {args}")
@@ -126,11 +265,15 @@ class CommandDispatcher:
         # place_pos[2] += 0.5
         # print(args[2], place_pos)
 
-        if args[1].startswith("block"):
-            urdf_key = "block"
-        else:
-            urdf_key = args[1]
+        entity_id = self.object_entity_dict.get(args[1])
+        if entity_id is None:
+            self.load_body(args[1], place_pos)
+            return
 
-        entity_id = p.loadURDF(self.entity_urdf_dict[urdf_key], place_pos, self.default_orientation)
-        self.entity_ids.append(entity_id)
-        self.object_entity_dict[args[1]] = entity_id
+        self.reset_body(entity_id, place_pos)
+        if entity_id in self.parked_masses:
+            p.changeDynamics(entity_id, -1, mass=self.parked_masses.pop(entity_id), physicsClientId=self.physicsClient)
+
+    def reset_body(self, entity_id: int, pos: Tuple[float, float, float] | List[float]) -> None:
+        p.resetBasePositionAndOrientation(entity_id, pos, self.default_orientation, physicsClientId=self.physicsClient)
+        p.resetBaseVelocity(entity_id, [0, 0, 0], [0, 0, 0], physicsClientId=self.physicsClient)
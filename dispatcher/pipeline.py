@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Generator, List, Tuple
+
+from eas.EAS import State
+from dispatcher.dispatcher import CommandDispatcher
+
+PlannerSteps = Generator[Tuple[str, List[str]], State | None, None]
+
+QUEUE_POLL_INTERVAL = 0.05
+
+@dataclass
+class ExecutionFailure:
+    step: int
+    action: Tuple[str, List[str]]
+    reason: str
+    observed_state: State | None = None # Where the planner should continue from, if it could be observed
+
+@dataclass
+class PipelineResult:
+    executed: List[Tuple[str, List[str]]] = field(default_factory=list)
+    failures: List[ExecutionFailure] = field(default_factory=list)
+    planner_error: Exception | None = None
+    time_to_first_action: float | None = None
+    total_time: float = 0.0
+
+    @property
+    def success(self) -> bool:
+        # Every failure has to be followed by executed actions planned from the observed state
+        return self.planner_error is None and (not self.failures or self.failures[-1].step < len(self.executed))
+
+class StreamingExecutor:
+    """
+        Runs a planner generator (see iterate_dtg_basic) in a background thread and executes its actions on the
+        dispatcher as they arrive, through a bounded queue so the planner cannot run arbitrarily far ahead.
+        When a command fails, the failure goes back to the planner through a feedback queue: with an observed state
+        the planner replans from it and queued actions planned before the failure are dropped, otherwise execution stops.
+        The dispatcher stays on the calling thread, pybullet GUI clients must not be used from other threads.
+    """
+    def __init__(self, dispatcher: CommandDispatcher, max_queued: int = 4, steps_per_command: int = 1,
+                 observe_state: Callable[[ExecutionFailure], State | None] | None = None):
+        self.dispatcher = dispatcher
+        self.steps_per_command = steps_per_command
+        self.observe_state = observe_state
+
+        self.actions: queue.Queue = queue.Queue(maxsize=max_queued) # (epoch, action), action None marks the end of the plan
+        self.feedback: queue.Queue = queue.Queue()
+        self.stop = threading.Event()
+        self.planner_error: Exception | None = None
+
+    def run(self, planner_steps: PlannerSteps) -> PipelineResult:
+        result = PipelineResult()
+        start = time.perf_counter()
+
+        producer = threading.Thread(target=self.produce, args=(planner_steps,), daemon=True)
+        producer.start()
+
+        epoch = 0
+        while True:
+            action_epoch, action = self.actions.get()
+            if action is None:
+                break
+            if action_epoch < epoch:
+                # Planned before the last failure was handled
+                continue
+
+            if result.time_to_first_action is None:
+                result.time_to_first_action = time.perf_counter() - start
+
+            cmd, args = action
+            reason = self.dispatcher.dispatch(cmd, args, self.steps_per_command)
+            if reason is None:
+                result.executed.append(action)
+                continue
+
+            failure = ExecutionFailure(step=len(result.executed), action=action, reason=reason)
+            if self.observe_state is not None:
+                failure.observed_state = self.observe_state(failure)
+            print(f"Execution failed at step {failure.step} {action}: {reason}")
+
+            result.failures.append(failure)
+            self.feedback.put(failure)
+            epoch += 1
+
+            if failure.observed_state is None:
+                break
+
+        self.stop.set()
+        producer.join()
+
+        result.planner_error = self.planner_error
+        result.total_time = time.perf_counter() - start
+        return result
+
+    def produce(self, planner_steps: PlannerSteps) -> None:
+        epoch = 0
+
+        try:
+            action = next(planner_steps)
+            while not self.stop.is_set():
+                failure = self.poll_feedback()
+                if failure is not None:
+                    epoch += 1
+                    if failure.observed_state is None:
+                        break
+                    action = planner_steps.send(failure.observed_state)
+                    continue
+
+                if self.put((epoch, action)):
+                    action = next(planner_steps)
+        except StopIteration:
+            pass
+        except Exception as e:
+            self.planner_error = e
+        finally:
+            planner_steps.close()
+            self.put_end(epoch)
+
+    def put(self, item: Tuple[int, Any]) -> bool:
+        """
+            Blocking put that gives up when execution reported a failure or the pipeline stopped in the meantime.
+        """
+        while not self.stop.is_set():
+            if not self.feedback.empty():
+                return False
+            try:
+                self.actions.put(item, timeout=QUEUE_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def put_end(self, epoch: int) -> None:
+        while not self.stop.is_set():
+            try:
+                self.actions.put((epoch, None), timeout=QUEUE_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def poll_feedback(self) -> ExecutionFailure | None:
+        try:
+            return self.feedback.get_nowait()
+        except queue.Empty:
+            return None
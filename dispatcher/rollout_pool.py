@@ -0,0 +1,129 @@
+import math
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple, cast
+
+from eas.EAS import Action, State
+from eas.block_domain import Pose, create_block_domain
+from eas.eas_parser import parse_configs
+from dispatcher.dispatcher import CommandDispatcher, BodyPose
+
+GOAL_TOLERANCE = 0.25 # Horizontal distance from the goal pose within which a block counts as placed
+
+@dataclass
+class RolloutResult:
+    config_name: str
+    plan_length: int
+    success: bool = False
+    final_poses: Dict[str, BodyPose] = field(default_factory=dict)
+    goal_errors: Dict[str, float] = field(default_factory=dict) # object name -> horizontal distance from its goal pose
+    setup_time: float = 0.0 # Time spent building the world, only non-zero for the first job of a config on a worker
+    run_time: float = 0.0
+    error: str | None = None
+
+class RolloutPool:
+    """
+        Pool of worker processes, each keeping a single headless CommandDispatcher. Jobs are (config name, plan) pairs.
+        A worker builds the world of a config, snapshots it with p.saveState and restores the snapshot before every
+        later job of the same config. A job for another config empties the simulation with p.resetSimulation and
+        loads the new world into the same client, so randomised scenes do not pile up physics clients.
+    """
+    def __init__(self, num_workers: int = 2, problem_config_path: str = "config/problem_configs/"):
+        self.num_workers = num_workers
+        self.pool = ProcessPoolExecutor(max_workers=num_workers, initializer=init_rollout_worker, initargs=(problem_config_path,))
+
+    def __enter__(self) -> 'RolloutPool':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def run(self, jobs: List[Tuple[str, List[Action]]]) -> List[RolloutResult]:
+        # Jobs of the same config go out next to each other, so workers reload their world as rarely as possible
+        order = sorted(range(len(jobs)), key=lambda job_id: jobs[job_id][0])
+        config_names = [jobs[job_id][0] for job_id in order]
+        plans = [jobs[job_id][1] for job_id in order]
+
+        results: List[RolloutResult] = [cast(RolloutResult, None)] * len(jobs)
+        for job_id, result in zip(order, self.pool.map(worker_rollout, config_names, plans)):
+            results[job_id] = result
+        return results
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+# Worker state lives at module level so that each process keeps its physics client between jobs
+_worker_context: Dict[str, Any] = {}
+
+def init_rollout_worker(problem_config_path: str) -> None:
+    _worker_context['problem_config_path'] = problem_config_path
+    _worker_context['dispatcher'] = None
+    _worker_context['config_name'] = None
+    _worker_context['goal_state'] = None
+
+    # Runs when the worker process exits, including on pool shutdown
+    Finalize(None, close_worker_dispatcher, exitpriority=10)
+
+def close_worker_dispatcher() -> None:
+    dispatcher = _worker_context.get('dispatcher')
+    if dispatcher is not None:
+        dispatcher.close()
+        _worker_context['dispatcher'] = None
+
+def worker_rollout(config_name: str, plan: List[Action]) -> RolloutResult:
+    result = RolloutResult(config_name=config_name, plan_length=len(plan))
+
+    try:
+        start = time.perf_counter()
+        dispatcher = worker_dispatcher(config_name)
+        result.setup_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result.final_poses = dispatcher.run_headless(plan)
+        result.run_time = time.perf_counter() - start
+
+        goal_state = _worker_context['goal_state']
+        result.goal_errors = goal_errors(result.final_poses, goal_state, dispatcher.name_things)
+        result.success = len(result.goal_errors) == len(goal_state) and all(err <= GOAL_TOLERANCE for err in result.goal_errors.values())
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+
+    return result
+
+def worker_dispatcher(config_name: str) -> CommandDispatcher:
+    dispatcher = _worker_context['dispatcher']
+
+    if dispatcher is not None and _worker_context['config_name'] == config_name:
+        dispatcher.restore_world()
+        return dispatcher
+
+    # Forget the old config first, a failed parse must not leave its world behind under the new name
+    _worker_context['config_name'] = None
+    domain = parse_configs(create_block_domain(), config_name, _worker_context['problem_config_path'])
+
+    if dispatcher is None:
+        dispatcher = CommandDispatcher(domain, headless=True)
+        dispatcher.initialize_objects()
+        _worker_context['dispatcher'] = dispatcher
+    else:
+        dispatcher.load_domain(domain)
+    dispatcher.save_world()
+
+    _worker_context['config_name'] = config_name
+    _worker_context['goal_state'] = domain.goal_state
+    return dispatcher
+
+def goal_errors(final_poses: Dict[str, BodyPose], goal_state: State, name_things: Dict) -> Dict[str, float]:
+    errors = {}
+    for goal_key, pose_name in goal_state.items():
+        obj_name = goal_key.rsplit('_', 1)[0]
+        if obj_name not in final_poses:
+            continue
+
+        goal_pos = cast(Pose, name_things[pose_name]).pos
+        errors[obj_name] = math.dist(final_poses[obj_name][0][:2], goal_pos[:2])
+
+    return errors
@@ -6,7 +6,9 @@ from copy import deepcopy
 State = NewType('State', Dict[str, Any]) # {object_name}_{variable_name}: value
 Action = NewType('Action', Tuple[str, List[Any]]) # (action_name, [param1, param2, ...])
 ConditionType = Enum('ConditionType', 'SIMPLE COMPUTED')
+StatePath = NewType('StatePath', str) # 'param' or 'param.var1.var2', resolved hop by hop through state values
 StateStatus = Enum('StateStatus', 'ALIVE DEAD GOAL')
+CanonicalState = NewType('CanonicalState', Tuple[Tuple[str, Any], ...]) # Sorted (variable, value) pairs with symmetric names relabelled
 
 @dataclass
 class Effect:
@@ -32,6 +34,7 @@ class LinkedState:
     parent: 'Tuple[Action, LinkedState] | None' = None # Parent state and the action connecting them. Only the root node has no parent
     branches_to_explore: List[Tuple['Node', str, 'Node']] = field(default_factory=list)  # home node, action name, target node
     edges: List[Tuple[str, 'LinkedState']] = field(default_factory=list) # action name, linked state
+    cost: float = 0.0 # Cost of the actions from the root to this state
 
     def __hash__(self):
         return hash(self.state.__str__())
@@ -75,6 +78,11 @@ class Thing:
     def __repr__(self):
         return f"{self.__class__.__name__}({self.name})"
 
+@dataclass
+class Symmetries:
+    block_classes: List[List[str]] = field(default_factory=list) # Interchangeable block names
+    stack_classes: List[List[List[str]]] = field(default_factory=list) # Interchangeable stacks of pose names, bottom to top
+
 @dataclass
 class Domain:
     things: Dict[Type[Thing], List[Thing]]
@@ -84,6 +92,8 @@ class Domain:
                              List[Condition],
                              List[Condition]]] = field(default_factory=dict)
     name_things: Dict[str, Thing] = field(default_factory=dict)
+    symmetries: Symmetries = field(default_factory=Symmetries)
+    listeners: List[Callable[[State], None]] = field(default_factory=list, repr=False, compare=False) # Called after every state update
 
     @property
     def current_state(self) -> State:
@@ -111,6 +121,19 @@ class Domain:
                     continue
                 setattr(thing, variable_name, value)
 
+        for listener in self.listeners:
+            listener(new_state)
+
+    def subscribe(self, listener: Callable[[State], None]) -> None:
+        """
+            Register a callback run after every update_state, once the things hold the values of the new state.
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[State], None]) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
     def reset_state(self) -> None:
         """
             Remove the last state and update the state values according to the new last state.
@@ -195,10 +218,9 @@ def apply_action(state: State, conditions: List[Condition], parameters: Dict[str
 
                 for attr in attrs[1:]:
                     target = getattr(target, attr, None)
-                    if target:
-                        target = target.name
-                        if target == 'GND':
-                            break
+                    if target is None or target.name == 'GND':
+                        break
+                target = target.name if target else None
         else:
             target = target_name
 
@@ -206,6 +228,119 @@ def apply_action(state: State, conditions: List[Condition], parameters: Dict[str
 
     return new_state
 
+# COMPUTED variables that only exist as properties on Things, written as a path relative to the Thing.
+# The variable is True when the path resolves to something other than None (resolution stops at GND).
+computed_state_paths: Dict[str, str] = {}
+
+def freeze_state(state: State) -> CanonicalState:
+    return CanonicalState(tuple(sorted(state.items(), key=lambda item: item[0])))
+
+def resolve_state_path(state: State, parameters: Dict[str, Any], path: StatePath) -> Any:
+    """
+        Resolve a (possibly dotted) parameter path against a state instead of the live Things, e.g.
+        'target_pose.on.occupied_by' -> state['{target_pose}_on'] -> state['{pose_below}_occupied_by'].
+        Resolution stops at None or GND.
+    """
+    attrs = path.split('.')
+    param = parameters.get(attrs[0])
+    value = getattr(param, 'name', param)
+
+    for attr in attrs[1:]:
+        if value is None or value == 'GND':
+            break
+        value = state.get(f"{value}_{attr}")
+
+    return value
+
+def find_failed_condition(state: State, conditions: List[Condition], parameters: Dict[str, Any]) -> Condition | None:
+    for cond in conditions:
+        param = parameters.get(cond.src_name)
+        if param is None:
+            raise ValueError(f"Parameter {cond.src_name} not found in parameters")
+        param_name = getattr(param, 'name', param)
+
+        if cond.cond_tp == ConditionType.COMPUTED and cond.var_name in computed_state_paths:
+            path = StatePath(f"{cond.src_name}.{computed_state_paths[cond.var_name]}")
+            current_val = resolve_state_path(state, parameters, path) is not None
+        else:
+            current_val = state.get(f"{param_name}_{cond.var_name}")
+
+        if type(cond.target_value) is str:
+            target = parameters.get(cond.target_value)
+            target = getattr(target, 'name', target)
+        else:
+            target = cond.target_value
+
+        if current_val != target:
+            return cond
+
+    return None
+
+def is_action_applicable_in_state(state: State, conditions: List[Condition], parameters: Dict[str, Any]) -> bool:
+    """
+        Same check as is_action_applicable, but reads the variables from the given state rather than the
+        live Things, so tentative states can be evaluated without pushing them onto the Domain.
+    """
+    return find_failed_condition(state, conditions, parameters) is None
+
+def apply_action_to_state(state: State, parameters: Dict[str, Any], effects: List[Effect]) -> State:
+    """
+        Pure counterpart of apply_action: all effect paths are resolved against the given state.
+        Applicability is not checked here.
+    """
+    new_state = State(dict(state))
+
+    for effect in effects:
+        parent = resolve_state_path(state, parameters, StatePath(effect.src_name))
+
+        if parent == 'GND':
+            continue
+
+        if parent is None:
+            raise ValueError(f"Parent {effect.src_name} not found in state when applying effect {effect.name}")
+
+        if type(effect.target_value) is str:
+            target = resolve_state_path(state, parameters, StatePath(effect.target_value))
+        else:
+            target = effect.target_value
+
+        new_state[f"{parent}_{effect.var_name}"] = target
+
+    return new_state
+
+def bind_action_params(action: Action, actions: Dict[str, Tuple[Dict, List, List]]) -> Dict[str, Any]:
+    """
+        Map the arguments of a grounded action back to the schema's parameter names. The arguments follow
+        the order of the schema parameters, the same order parse_action_params produces.
+    """
+    action_name, args = action
+    if action_name not in actions:
+        raise ValueError(f"Unknown action: {action_name}")
+
+    parameters, _, _ = actions[action_name]
+    if len(args) != len(parameters):
+        raise ValueError(f"Action {action_name} takes {len(parameters)} arguments, got {len(args)}")
+
+    return dict(zip(parameters.keys(), args))
+
+def replay_plan(state: State, plan: List[Action], actions: Dict[str, Tuple[Dict, List, List]]) -> List[State] | None:
+    """
+        Symbolically execute a plan from a state. Returns every visited state, starting with the given one,
+        or None as soon as an action is not applicable.
+    """
+    states = [state]
+    for action in plan:
+        _, conds, effects = actions[action[0]]
+        parameters = bind_action_params(action, actions)
+        if not is_action_applicable_in_state(states[-1], conds, parameters):
+            return None
+        states.append(apply_action_to_state(states[-1], parameters, effects))
+
+    return states
+
+def goal_holds(state: State, goal_state: State) -> bool:
+    return all(state.get(goal_key) == goal_value for goal_key, goal_value in goal_state.items())
+
 def parse_action_params(action_name: str, node: Node, target: Node) -> Dict[str, Thing]:
     action_params = {}
     match action_name:
@@ -235,6 +370,30 @@ def parse_action_params(action_name: str, node: Node, target: Node) -> Dict[str,
 
     return action_params
 
+def ground_operators(dtg: Dict[str, Node]) -> Dict[str, List[Tuple[Action, Dict[str, str]]]]:
+    """
+        Ground the edges of every DTG node into (action, parameter names) pairs, keyed by node name.
+        The result only holds names, so it can be shipped to worker processes and queried with a state
+        the same way query_nodes does.
+    """
+    operators = {}
+    for node_name, node in dtg.items():
+        node_operators = []
+        for action_name, target in node.edges:
+            action_params = parse_action_params(action_name, node, target)
+            param_names = {param: getattr(thing, 'name', thing) for param, thing in action_params.items()}
+            node_operators.append((Action((action_name, list(param_names.values()))), param_names))
+
+        operators[node_name] = node_operators
+
+    return operators
+
+def query_operators(operators: Dict[str, List[Tuple[Action, Dict[str, str]]]], state: State) -> List[Tuple[Action, Dict[str, str]]]:
+    state_operators = []
+    for var, val in state.items():
+        state_operators.extend(operators.get(f"{var}_{val}", []))
+    return state_operators
+
 def query_nodes(dtg: Dict[str, Node], state: State) -> List[Node]:
     nodes = []
     for var, val in state.items():
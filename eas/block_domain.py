@@ -3,7 +3,7 @@ import numpy as np
 from dataclasses import dataclass, field
 from typing import Tuple, List, Dict, cast
 
-from eas.EAS import Thing, State, Domain, Node, Condition, Effect, ConditionType
+from eas.EAS import Thing, State, Domain, Node, Condition, Effect, ConditionType, computed_state_paths
 
 @dataclass(eq=False)
 class Ground(Thing):
@@ -40,6 +40,9 @@ class Pose(Thing):
     def supported(self, value: bool) -> None:
         self._supported = self.supported
 
+# A pose is supported when it is on the ground or the pose below it is occupied, see Pose.supported
+computed_state_paths['supported'] = 'on.occupied_by'
+
 @dataclass(eq=False)
 class Object(Thing):
     at: Pose | None
@@ -100,9 +103,20 @@ pick_effects = cast(List[Condition], pick_effects)
 place_conditions = cast(List[Condition], place_conditions)
 place_effects = cast(List[Condition], place_effects)
 
-domain = Domain(things={}, states=[], goal_state=State({}), actions={'move': (move_parameters, move_conditions, move_effects),
-                                                                     'pick': (pick_parameters, pick_conditions, pick_effects),
-                                                                     'place': (place_parameters, place_conditions, place_effects)})
+# Action schemas shared by every block world Domain, they are only read
+block_actions = {'move': (move_parameters, move_conditions, move_effects),
+                 'pick': (pick_parameters, pick_conditions, pick_effects),
+                 'place': (place_parameters, place_conditions, place_effects)}
+
+def create_block_domain() -> Domain:
+    """
+        A fresh, empty Domain with the block world action schemas. parse_configs adds the things of a problem to
+        the Domain it is given, so every problem needs its own Domain.
+    """
+    return Domain(things={}, states=[], goal_state=State({}), actions=block_actions)
+
+# Module-level Domain for single-problem scripts, use create_block_domain to parse more than one problem per process
+domain = create_block_domain()
 
 def create_domain_transition_graph(domain: Domain) -> Dict[str, Node]:
     robot_dtg, block_dtg = create_nodes(domain)
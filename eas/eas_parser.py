@@ -1,40 +1,52 @@
+import os
 import numpy as np
 
-from yaml import safe_load
 from typing import Dict, List, Tuple, cast
 from scipy.spatial import KDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 from eas.EAS import Domain, State
 from eas.block_domain import Robot, Pose, Object, Ground    
+from eas.symmetry import find_symmetries
+from eas.problem_format import PROBLEM_FILE, config_dir, has_binary_problem, load_binary_problem, load_yaml_configs
 
-def parse_configs(domain: Domain, config_name: str, problem_config_path: str = "config/problem_configs/") -> Domain:
+POSITION_DECIMALS = 6 # Positions equal to this many decimals are the same pose
+STACK_RADIUS = 0.05 # Poses closer than this horizontally are in the same stack
+
+PoseIndex = Dict[Tuple[float, ...], Pose]
+
+def parse_configs(domain: Domain, config_name: str, problem_config_path: str = "config/problem_configs/", verbose: bool = True) -> Domain:
     gnd = Ground()
     domain.things.setdefault(Ground, []).append(gnd)
     domain.name_things[gnd.name] = gnd
 
     init_config, goal_config = load_configs_to_dict(config_name, problem_config_path)
-    define_init_objects_and_poses(init_config, domain)
-    define_goal_objects_and_poses(goal_config, domain)
-    build_physical_relations(domain)
-    initialize_states_and_domain(domain)
+    pose_index = define_init_objects_and_poses(init_config, domain)
+    define_goal_objects_and_poses(goal_config, domain, pose_index, verbose)
+    stacks = build_physical_relations(domain, verbose)
+    domain.symmetries = find_symmetries(domain, stacks)
+    initialize_states_and_domain(domain, verbose)
 
     return domain
 
 def load_configs_to_dict(config_name: str, problem_config_path: str) -> Tuple[Dict, Dict]:
-    init_path = problem_config_path + config_name + "/init.yaml"
-    goal_path = problem_config_path + config_name + "/goal.yaml"
-
-    with open(init_path, 'r') as f:
-        init_config = safe_load(f)
-        f.close()
-
-    with open(goal_path, 'r') as f:
-        goal_config = safe_load(f)
-        f.close()
-
-    return init_config, goal_config
-
-def define_init_objects_and_poses(init_config: Dict, domain: Domain):
+    """
+        Load the problem from problem.npz if the config has an up-to-date one, see eas.problem_format, otherwise from YAML.
+    """
+    if has_binary_problem(config_name, problem_config_path):
+        return load_binary_problem(os.path.join(config_dir(config_name, problem_config_path), PROBLEM_FILE))
+
+    return load_yaml_configs(config_name, problem_config_path)
+
+def position_key(pos: Tuple[float, float, float]) -> Tuple[float, ...]:
+    return tuple(round(float(coord), POSITION_DECIMALS) for coord in pos)
+
+def define_init_objects_and_poses(init_config: Dict, domain: Domain) -> PoseIndex:
+    """
+        Returns the poses by rounded position, for the goal lookups.
+    """
+    pose_index: PoseIndex = {}
     idx = 1
     for obj_name, info in init_config.items():
         obj_type = obj_name.split('_')[0]
@@ -55,65 +67,89 @@ def define_init_objects_and_poses(init_config: Dict, domain: Domain):
 
         domain.things.setdefault(Pose, []).append(pose)
         domain.name_things[pose.name] = pose
+        pose_index.setdefault(position_key(pose.pos), pose)
 
         idx += 1
 
-def define_goal_objects_and_poses(goal_config: Dict, domain: Domain):
+    return pose_index
+
+def define_goal_objects_and_poses(goal_config: Dict, domain: Domain, pose_index: PoseIndex | None = None, verbose: bool = True):
+    poses = cast(List[Pose], domain.things.setdefault(Pose, []))
+    if pose_index is None:
+        pose_index = {}
+        for pose in poses:
+            pose_index.setdefault(position_key(pose.pos), pose)
+
     goal_state = State({})
     for obj_name, info in goal_config.items():
         pos = info['position']
 
-        poses = domain.things.get(Pose, [])
-        poses = cast(List[Pose], poses)
-        pose = find_pose_from_position(pos, poses)
+        pose = find_pose_from_position(pos, poses, pose_index)
         goal_state.update({f"{obj_name}_at": pose.name})
 
-        if pose not in poses:
-            domain.things.setdefault(Pose, []).append(pose)
+        if position_key(pos) not in pose_index:
+            poses.append(pose)
             domain.name_things[pose.name] = pose
-            print(f"Added new goal pose: {pose}")
+            pose_index[position_key(pos)] = pose
+            if verbose:
+                print(f"Added new goal pose: {pose}")
 
     domain.goal_state = goal_state
 
-def find_pose_from_position(pos: Tuple[float, float, float], poses: List[Pose]) -> Pose:
-    positions = [pose.pos for pose in poses]
-
-    for idx, position in enumerate(positions):
-        if np.allclose(np.array(position), np.array(pos)):
-            return poses[idx]
+def find_pose_from_position(pos: Tuple[float, float, float], poses: List[Pose], pose_index: PoseIndex) -> Pose:
+    """
+        The pose at a position, looked up by rounded position. A new pose, not yet added to poses, if there is none.
+    """
+    pose = pose_index.get(position_key(pos))
+    if pose is not None:
+        return pose
 
     pose_name = 'p' + str(len(poses) + 1)
     pose = Pose(pose_name, pos)
     return pose
 
-def initialize_states_and_domain(domain: Domain):
+def initialize_states_and_domain(domain: Domain, verbose: bool = True):
     init_state = State({})
     for thing_list in domain.things.values():
         for thing in thing_list:
-            print(thing.name, thing.state)
-            init_state.update(thing.state)
+            thing_state = thing.state
+            if verbose:
+                print(thing.name, thing_state)
+            init_state.update(thing_state)
 
     domain.states.append(init_state)
 
-def build_physical_relations(domain: Domain) -> List[List[str]]:
-    visited_positions = []
-    stacks = []
+def find_stacks(poses: List[Pose]) -> List[List[Pose]]:
+    """
+        Group poses into stacks: connected components of the poses within STACK_RADIUS of each other horizontally.
+        Stacks are ordered by their first pose, poses bottom to top by height and then by their order in poses.
+    """
+    if not poses:
+        return []
 
-    poses = domain.things.get(Pose, [])
-    poses = cast(List[Pose], poses)
-    positions = [pose.pos[:2] for pose in poses]
-    pos_tree = KDTree(positions)
+    positions = np.array([pose.pos for pose in poses], dtype=float)
+    pairs = KDTree(positions[:, :2]).query_pairs(r=STACK_RADIUS, p=2, output_type='ndarray')
+
+    adjacency = coo_matrix((np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])), shape=(len(poses), len(poses)))
+    _, labels = connected_components(adjacency, directed=False)
+
+    # Renumber stacks in order of their first pose
+    first_pose = np.full(labels.max() + 1, len(poses))
+    np.minimum.at(first_pose, labels, np.arange(len(poses)))
+    stack_rank = np.argsort(np.argsort(first_pose))[labels]
 
-    for i, pos in enumerate(positions):
-        if i in visited_positions:
-            continue
+    order = np.lexsort((np.arange(len(poses)), positions[:, 2], stack_rank))
+    boundaries = np.flatnonzero(np.diff(stack_rank[order])) + 1
 
-        pos_idx_in_stack = pos_tree.query_ball_point(pos, r=0.05, p=2)
-        visited_positions.extend(pos_idx_in_stack)
+    return [[poses[idx] for idx in stack] for stack in np.split(order, boundaries)]
 
-        poses_in_stack = np.array(poses)[pos_idx_in_stack]
-        poses_in_stack = sorted(poses_in_stack, key=lambda p: (p.pos[2]))
+def build_physical_relations(domain: Domain, verbose: bool = True) -> List[List[str]]:
+    stacks = []
+
+    poses = domain.things.get(Pose, [])
+    poses = cast(List[Pose], poses)
 
+    for poses_in_stack in find_stacks(poses):
         for j, pose in enumerate(poses_in_stack):
             if j == 0:
                 pose.on = domain.name_things['GND']
@@ -121,7 +157,8 @@ def build_physical_relations(domain: Domain) -> List[List[str]]:
 
                 if type(occupied_obj) is Object:
                     occupied_obj.on = cast(Ground, domain.name_things['GND'])
-                    print(f"Set {occupied_obj.name} on GND")
+                    if verbose:
+                        print(f"Set {occupied_obj.name} on GND")
 
             if j < len(poses_in_stack) - 1 and j > 0:
                 above_pose = poses_in_stack[j+1]
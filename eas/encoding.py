@@ -0,0 +1,243 @@
+import numpy as np
+
+from typing import Any, Dict, List, Tuple
+
+from eas.EAS import Action, State, Node, Domain, Condition, Effect, ConditionType
+from eas.EAS import ground_operators, computed_state_paths
+
+NONE_CODE = 0
+TRUE_CODE = 1
+FALSE_CODE = 2
+MAX_PATH_HOPS = 3
+
+class EncodedProblem:
+    """
+        Integer encoding of a Domain and of the grounded actions on its DTG edges.
+        A state is a row of value codes, one column per state variable, so batches of states are 2-D arrays.
+        Value codes index self.values: None, True, False and then every Thing name, so node and pose IDs are value codes.
+        Operators are numbered in DTG order: the edges of a node occupy a contiguous range of operator IDs.
+    """
+    def __init__(self, domain: Domain, dtg: Dict[str, Node]):
+        self.variables = list(domain.current_state.keys())
+        self.var_index = {var: col for col, var in enumerate(self.variables)}
+
+        self.values: List[Any] = [None, True, False] + list(domain.name_things.keys())
+        self.value_index = {val: code for code, val in enumerate(self.values) if code > FALSE_CODE}
+        self.gnd_code = self.value_index.get('GND', -1)
+
+        # col_of[thing code, variable name id] -> state column, or -1 if the Thing has no such variable
+        var_names = sorted(set(var.split('_', 1)[1] for var in self.variables))
+        self.var_name_index = {var_name: idx for idx, var_name in enumerate(var_names)}
+        self.col_of = np.full((len(self.values), len(var_names)), -1, dtype=np.int64)
+        for col, var in enumerate(self.variables):
+            thing_name, var_name = var.split('_', 1)
+            self.col_of[self.value_index[thing_name], self.var_name_index[var_name]] = col
+
+        self.node_names = list(dtg.keys())
+        self.node_index = {name: idx for idx, name in enumerate(self.node_names)}
+        # A node is active when its Thing's 'at' variable holds the node's value
+        self.node_col = np.array([self.var_index[f"{node.values[-2].name}_at"] for node in dtg.values()], dtype=np.int64)
+        self.node_val = np.array([self.encode_value(getattr(node.values[-1], 'name', None)) for node in dtg.values()], dtype=np.int64)
+
+        operators = ground_operators(dtg)
+        self.operators: List[Tuple[Action, Dict[str, str]]] = []
+        op_node, op_target_node = [], []
+        for node_name, node in dtg.items():
+            for (action, params), (_, target) in zip(operators[node_name], node.edges):
+                self.operators.append((action, params))
+                op_node.append(self.node_index[node_name])
+                op_target_node.append(self.node_index[target.name])
+
+        self.op_node = np.array(op_node, dtype=np.int64)
+        self.op_target_node = np.array(op_target_node, dtype=np.int64)
+        self.node_ops = np.full((len(self.node_names), max(np.bincount(self.op_node, minlength=1).max(), 1)), -1, dtype=np.int64)
+        for node_id in range(len(self.node_names)):
+            ops = np.flatnonzero(self.op_node == node_id)
+            self.node_ops[node_id, :ops.size] = ops
+
+        self.compile_conditions(domain.actions)
+        self.compile_effects(domain.actions)
+
+        rng = np.random.default_rng(0)
+        self.hash_weights = rng.integers(1, 2**63, size=len(self.variables), dtype=np.uint64) | np.uint64(1)
+
+    def encode_value(self, value: Any) -> int:
+        if value is None:
+            return NONE_CODE
+        if value is True:
+            return TRUE_CODE
+        if value is False:
+            return FALSE_CODE
+        return self.value_index[value]
+
+    def encode(self, state: State) -> np.ndarray:
+        return np.array([self.encode_value(state.get(var)) for var in self.variables], dtype=np.int64)
+
+    def decode(self, row: np.ndarray) -> State:
+        return State({var: self.values[code] for var, code in zip(self.variables, row.tolist())})
+
+    def compile_path(self, params: Dict[str, str], path: str) -> Tuple[int, List[int]]:
+        attrs = path.split('.')
+        if len(attrs) - 1 > MAX_PATH_HOPS:
+            raise ValueError(f"Path {path} is longer than {MAX_PATH_HOPS} hops")
+
+        unknown = [attr for attr in attrs[1:] if attr not in self.var_name_index]
+        if unknown:
+            raise ValueError(f"Path {path} uses variables {unknown} that no Thing in the domain has")
+
+        hops = [self.var_name_index[attr] for attr in attrs[1:]]
+        return self.encode_value(params.get(attrs[0])), hops + [-1] * (MAX_PATH_HOPS - len(hops))
+
+    def compile_conditions(self, actions: Dict[str, Tuple[Dict, List[Condition], List]]) -> None:
+        simple, computed = [], []
+
+        for action, params in self.operators:
+            _, conds, _ = actions[action[0]]
+            op_simple, op_computed = [], []
+
+            for cond in conds:
+                if type(cond.target_value) is str:
+                    target = self.encode_value(params.get(cond.target_value))
+                else:
+                    target = self.encode_value(cond.target_value)
+
+                if cond.cond_tp == ConditionType.COMPUTED and cond.var_name in computed_state_paths:
+                    start, hops = self.compile_path(params, f"{cond.src_name}.{computed_state_paths[cond.var_name]}")
+                    op_computed.append((start, hops, target == TRUE_CODE))
+                else:
+                    col = self.col_of[self.encode_value(params[cond.src_name]), self.var_name_index[cond.var_name]]
+                    op_simple.append((col, target))
+
+            simple.append(op_simple)
+            computed.append(op_computed)
+
+        n_ops = len(self.operators)
+        max_simple = max([len(c) for c in simple] + [1])
+        max_computed = max([len(c) for c in computed] + [1])
+
+        self.pre_cols = np.zeros((n_ops, max_simple), dtype=np.int64)
+        self.pre_vals = np.zeros((n_ops, max_simple), dtype=np.int64)
+        self.pre_mask = np.zeros((n_ops, max_simple), dtype=bool)
+        for op, op_simple in enumerate(simple):
+            for j, (col, target) in enumerate(op_simple):
+                self.pre_cols[op, j], self.pre_vals[op, j], self.pre_mask[op, j] = col, target, True
+
+        self.comp_start = np.zeros((n_ops, max_computed), dtype=np.int64)
+        self.comp_hops = np.full((n_ops, max_computed, MAX_PATH_HOPS), -1, dtype=np.int64)
+        self.comp_expected = np.zeros((n_ops, max_computed), dtype=bool)
+        self.comp_mask = np.zeros((n_ops, max_computed), dtype=bool)
+        for op, op_computed in enumerate(computed):
+            for j, (start, hops, expected) in enumerate(op_computed):
+                self.comp_start[op, j], self.comp_hops[op, j], self.comp_expected[op, j], self.comp_mask[op, j] = start, hops, expected, True
+
+    def compile_effects(self, actions: Dict[str, Tuple[Dict, List, List[Effect]]]) -> None:
+        n_ops = len(self.operators)
+        max_effects = max([len(actions[action[0]][2]) for action, _ in self.operators] + [1])
+
+        self.eff_start = np.zeros((n_ops, max_effects), dtype=np.int64)
+        self.eff_hops = np.full((n_ops, max_effects, MAX_PATH_HOPS), -1, dtype=np.int64)
+        self.eff_var = np.zeros((n_ops, max_effects), dtype=np.int64)
+        self.eff_mask = np.zeros((n_ops, max_effects), dtype=bool)
+        self.eff_target_const = np.zeros((n_ops, max_effects), dtype=np.int64)
+        self.eff_target_is_path = np.zeros((n_ops, max_effects), dtype=bool)
+        self.eff_target_start = np.zeros((n_ops, max_effects), dtype=np.int64)
+        self.eff_target_hops = np.full((n_ops, max_effects, MAX_PATH_HOPS), -1, dtype=np.int64)
+
+        for op, (action, params) in enumerate(self.operators):
+            _, _, effects = actions[action[0]]
+            for j, effect in enumerate(effects):
+                self.eff_start[op, j], self.eff_hops[op, j] = self.compile_path(params, effect.src_name)
+                self.eff_var[op, j] = self.var_name_index[effect.var_name]
+                self.eff_mask[op, j] = True
+
+                if type(effect.target_value) is str:
+                    self.eff_target_is_path[op, j] = True
+                    self.eff_target_start[op, j], self.eff_target_hops[op, j] = self.compile_path(params, effect.target_value)
+                else:
+                    self.eff_target_const[op, j] = self.encode_value(effect.target_value)
+
+    def resolve(self, frontier: np.ndarray, rows: np.ndarray, start: np.ndarray, hops: np.ndarray) -> np.ndarray:
+        """
+            Vectorised resolve_state_path: follow the variable hops from the start codes in frontier[rows].
+            hops has one more axis than start, padded with -1. Resolution stops at None and GND.
+        """
+        value = np.array(start, copy=True)
+        for h in range(hops.shape[-1]):
+            hop = hops[..., h]
+            active = (hop >= 0) & (value != NONE_CODE) & (value != self.gnd_code)
+            col = np.where(active, self.col_of[value, np.maximum(hop, 0)], -1)
+            hop_value = np.where(col >= 0, frontier[rows, np.maximum(col, 0)], NONE_CODE)
+            value = np.where(active, hop_value, value)
+
+        return value
+
+    def applicable(self, frontier: np.ndarray, ops: np.ndarray | None = None) -> np.ndarray:
+        """
+            Boolean matrix (states, operators): whether each operator's preconditions hold in each state of the frontier.
+        """
+        ops = np.arange(len(self.operators)) if ops is None else ops
+
+        values = frontier[:, self.pre_cols[ops]]
+        mask = np.all((values == self.pre_vals[ops]) | ~self.pre_mask[ops], axis=2)
+
+        # Computed conditions are only resolved for the operators that have any
+        comp_idx = np.flatnonzero(self.comp_mask[ops].any(axis=1))
+        if comp_idx.size:
+            comp_ops = ops[comp_idx]
+            rows = np.arange(frontier.shape[0])[:, None, None]
+            start = np.broadcast_to(self.comp_start[comp_ops], (frontier.shape[0],) + self.comp_start[comp_ops].shape)
+            resolved = self.resolve(frontier, rows, start, self.comp_hops[comp_ops][None])
+            holds = (resolved != NONE_CODE) == self.comp_expected[comp_ops]
+            mask[:, comp_idx] &= np.all(holds | ~self.comp_mask[comp_ops], axis=2)
+
+        return mask
+
+    def successors(self, frontier: np.ndarray, rows: np.ndarray, ops: np.ndarray) -> np.ndarray:
+        """
+            Apply operator ops[k] to frontier[rows[k]] for every k. Effects are resolved against the parent state
+            and written in schema order, the same way apply_action_to_state does.
+        """
+        children = frontier[rows].copy()
+        child_idx = np.arange(rows.size)
+
+        cols, targets, writes = [], [], []
+        for j in range(self.eff_mask.shape[1]):
+            parent = self.resolve(frontier, rows, self.eff_start[ops, j], self.eff_hops[ops, j])
+            col = self.col_of[parent, self.eff_var[ops, j]]
+            write = self.eff_mask[ops, j] & (parent != NONE_CODE) & (parent != self.gnd_code) & (col >= 0)
+
+            target = np.where(self.eff_target_is_path[ops, j],
+                              self.resolve(frontier, rows, self.eff_target_start[ops, j], self.eff_target_hops[ops, j]),
+                              self.eff_target_const[ops, j])
+
+            cols.append(col)
+            targets.append(target)
+            writes.append(write)
+
+        for col, target, write in zip(cols, targets, writes):
+            children[child_idx[write], col[write]] = target[write]
+
+        return children
+
+    def node_active(self, frontier: np.ndarray) -> np.ndarray:
+        return frontier[:, self.node_col] == self.node_val
+
+    def encode_goal(self, goal_state: State) -> Tuple[np.ndarray, np.ndarray]:
+        cols = np.array([self.var_index[var] for var in goal_state.keys()], dtype=np.int64)
+        vals = np.array([self.encode_value(val) for val in goal_state.values()], dtype=np.int64)
+        return cols, vals
+
+    def row_hashes(self, frontier: np.ndarray) -> np.ndarray:
+        """
+            64 bit hash of every row, used to deduplicate frontiers with np.unique and np.isin.
+            The weights are fixed so hashes of different layers can be compared.
+        """
+        return (frontier.astype(np.uint64) * self.hash_weights).sum(axis=1, dtype=np.uint64)
+
+    def row_keys(self, frontier: np.ndarray) -> np.ndarray:
+        """
+            Exact key of every row: its bytes as a single np.void value. Unlike row_hashes these cannot collide,
+            and np.unique, np.isin and np.union1d work on them directly.
+        """
+        rows = np.ascontiguousarray(frontier)
+        return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
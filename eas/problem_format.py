@@ -0,0 +1,106 @@
+import os
+import sys
+import numpy as np
+
+from typing import Dict, Tuple
+
+from yaml import load
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+PROBLEM_FILE = "problem.npz" # Binary problem next to init.yaml and goal.yaml
+FORMAT_VERSION = 1
+
+def config_dir(config_name: str, problem_config_path: str) -> str:
+    return os.path.join(problem_config_path, config_name)
+
+def has_binary_problem(config_name: str, problem_config_path: str) -> bool:
+    """
+        Whether the config has a problem.npz that is at least as new as its YAML files, so a stale binary is never used.
+    """
+    directory = config_dir(config_name, problem_config_path)
+    npz_path = os.path.join(directory, PROBLEM_FILE)
+    if not os.path.exists(npz_path):
+        return False
+
+    yaml_paths = [os.path.join(directory, file_name) for file_name in ("init.yaml", "goal.yaml")]
+    return all(os.path.getmtime(npz_path) >= os.path.getmtime(path) for path in yaml_paths if os.path.exists(path))
+
+def load_yaml_configs(config_name: str, problem_config_path: str) -> Tuple[Dict, Dict]:
+    directory = config_dir(config_name, problem_config_path)
+
+    with open(os.path.join(directory, "init.yaml"), 'r') as f:
+        init_config = load(f, Loader=SafeLoader)
+
+    with open(os.path.join(directory, "goal.yaml"), 'r') as f:
+        goal_config = load(f, Loader=SafeLoader)
+
+    return init_config, goal_config
+
+def save_binary_problem(init_config: Dict, goal_config: Dict, file_path: str) -> None:
+    """
+        One array per field, in config order. Missing vectors are NaN rows and missing types empty strings.
+    """
+    def vectors(config: Dict, key: str, length: int) -> np.ndarray:
+        rows = [info.get(key) for info in config.values()]
+        return np.array([row if row is not None else [np.nan] * length for row in rows], dtype=float).reshape(-1, length)
+
+    np.savez(file_path,
+             version=np.array(FORMAT_VERSION),
+             names=np.array(list(init_config.keys()), dtype=str),
+             types=np.array([info.get('type', '') for info in init_config.values()], dtype=str),
+             positions=vectors(init_config, 'position', 3),
+             orientations=vectors(init_config, 'orientation', 3),
+             colors=vectors(init_config, 'color', 3),
+             sizes=np.array([info.get('size', np.nan) for info in init_config.values()], dtype=float),
+             goal_names=np.array(list(goal_config.keys()), dtype=str),
+             goal_positions=vectors(goal_config, 'position', 3),
+             goal_orientations=vectors(goal_config, 'orientation', 3))
+
+def load_binary_problem(file_path: str) -> Tuple[Dict, Dict]:
+    """
+        The same (init, goal) dicts as the YAML files, minus fields they did not have.
+    """
+    with np.load(file_path) as data:
+        if int(data['version']) != FORMAT_VERSION:
+            raise ValueError(f"Unsupported problem file version {int(data['version'])} in {file_path}")
+
+        fields = {key: data[key].tolist() for key in data.files if key != 'version'}
+
+    def entry(**values) -> Dict:
+        info = {}
+        for key, value in values.items():
+            if value == '' or value != value or (isinstance(value, list) and value[0] != value[0]):
+                continue # Empty string or NaN, the field was missing
+            info[key] = value
+        return info
+
+    init_config = {name: entry(type=obj_type, position=position, orientation=orientation, color=color, size=size)
+                   for name, obj_type, position, orientation, color, size in
+                   zip(fields['names'], fields['types'], fields['positions'], fields['orientations'], fields['colors'], fields['sizes'])}
+    goal_config = {name: entry(position=position, orientation=orientation)
+                   for name, position, orientation in zip(fields['goal_names'], fields['goal_positions'], fields['goal_orientations'])}
+
+    return init_config, goal_config
+
+def convert_config(config_name: str, problem_config_path: str = "config/problem_configs/") -> str:
+    """
+        Write problem.npz next to the YAML files of a config. Returns its path.
+    """
+    init_config, goal_config = load_yaml_configs(config_name, problem_config_path)
+    file_path = os.path.join(config_dir(config_name, problem_config_path), PROBLEM_FILE)
+    save_binary_problem(init_config, goal_config, file_path)
+    return file_path
+
+if __name__ == "__main__":
+    # python -m eas.problem_format <config name> [<config name> ...] [--path <problem config path>]
+    args = sys.argv[1:]
+    path = "config/problem_configs/"
+    if "--path" in args:
+        path = args.pop(args.index("--path") + 1)
+        args.remove("--path")
+
+    for name in args:
+        print(f"Wrote {convert_config(name, path)}")
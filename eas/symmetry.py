@@ -0,0 +1,72 @@
+from typing import Any, Dict, List, Tuple, cast
+
+from eas.EAS import Domain, State, Symmetries, CanonicalState
+from eas.block_domain import Object
+
+BLOCK_PLACEHOLDER = '*'
+
+def find_symmetries(domain: Domain, stacks: List[List[str]]) -> Symmetries:
+    """
+        Blocks that appear in no goal are interchangeable, and so are stacks of equal height that hold no goal pose.
+        The stacks are the pose name lists returned by build_physical_relations, ordered bottom to top.
+    """
+    goal_blocks = set(goal_key.rsplit('_', 1)[0] for goal_key in domain.goal_state.keys())
+    goal_poses = set(domain.goal_state.values())
+
+    blocks = cast(List[Object], domain.things.get(Object, []))
+    distractor_blocks = [block.name for block in blocks if block.name not in goal_blocks]
+    block_classes = [distractor_blocks] if len(distractor_blocks) > 1 else []
+
+    stacks_by_height: Dict[int, List[List[str]]] = {}
+    for stack in stacks:
+        if goal_poses.intersection(stack):
+            continue
+        stacks_by_height.setdefault(len(stack), []).append(stack)
+
+    stack_classes = [stack_class for stack_class in stacks_by_height.values() if len(stack_class) > 1]
+
+    return Symmetries(block_classes=block_classes, stack_classes=stack_classes)
+
+def canonicalize_state(state: State, symmetries: Symmetries) -> CanonicalState:
+    """
+        Relabel interchangeable blocks and stacks so that symmetric states map to the same canonical state.
+        Distractor blocks collapse onto a single placeholder, and the stacks of each class are reassigned
+        to the class's pose names in order of their contents.
+    """
+    renaming: Dict[Any, Any] = {}
+    for block_class in symmetries.block_classes:
+        for block_name in block_class:
+            renaming[block_name] = BLOCK_PLACEHOLDER
+
+    things_at: Dict[str, List[str]] = {}
+    for var, val in state.items():
+        thing_name, variable_name = var.split('_', 1)
+        if variable_name == 'at' and val is not None:
+            things_at.setdefault(val, []).append(renaming.get(thing_name, thing_name))
+
+    for stack_class in symmetries.stack_classes:
+        signatures = [(repr(stack_signature(state, stack, things_at)), idx) for idx, stack in enumerate(stack_class)]
+        signatures.sort()
+
+        for slot, (_, idx) in enumerate(signatures):
+            for pose_name, slot_pose_name in zip(stack_class[idx], stack_class[slot]):
+                renaming[pose_name] = slot_pose_name
+
+    canonical_items = []
+    for var, val in state.items():
+        thing_name, variable_name = var.split('_', 1)
+        thing_name = renaming.get(thing_name, thing_name)
+        if isinstance(val, str):
+            val = renaming.get(val, val)
+
+        canonical_items.append((f"{thing_name}_{variable_name}", val))
+
+    canonical_items.sort(key=lambda item: (item[0], repr(item[1])))
+    return CanonicalState(tuple(canonical_items))
+
+def stack_signature(state: State, stack: List[str], things_at: Dict[str, List[str]]) -> Tuple:
+    signature = []
+    for pose_name in stack:
+        signature.append((sorted(things_at.get(pose_name, [])), state.get(f"{pose_name}_clear")))
+
+    return tuple(signature)
@@ -0,0 +1,100 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from eas.EAS import Action, State, Domain, Condition, Effect
+from eas.EAS import bind_action_params, find_failed_condition, apply_action_to_state, goal_holds
+
+ActionSchemas = Dict[str, Tuple[Dict, List[Condition], List[Effect]]]
+
+@dataclass
+class ValidationResult:
+    valid: bool
+    steps_executed: int
+    failed_step: int | None = None
+    failed_action: Action | None = None
+    failed_condition: Condition | None = None
+    message: str = ""
+    final_state: State | None = None
+
+    def __bool__(self) -> bool:
+        return self.valid
+
+    def __str__(self) -> str:
+        if self.valid:
+            return f"Plan valid ({self.steps_executed} actions)"
+        if self.failed_step is None:
+            return f"Plan invalid after {self.steps_executed} actions: {self.message}"
+        return f"Plan invalid at step {self.failed_step} {self.failed_action}: {self.message}"
+
+def validate_plan(plan: List[Action], domain: Domain, start_state: State | None = None, require_goal: bool = True) -> ValidationResult:
+    """
+        Replay a plan symbolically with the domain's action schemas, without touching the Domain or pybullet.
+        Reports the first action whose preconditions do not hold and the failed condition. By default the
+        plan is also invalid if it does not end in a goal state.
+    """
+    start_state = domain.states[0] if start_state is None else start_state
+    return validate_in_state(plan, start_state, domain.goal_state, domain.actions, require_goal, keep_final_state=True)
+
+def validate_in_state(plan: List[Action], start_state: State, goal_state: State, actions: ActionSchemas,
+                      require_goal: bool = True, keep_final_state: bool = False) -> ValidationResult:
+    state = start_state
+
+    for step, action in enumerate(plan):
+        try:
+            parameters = bind_action_params(action, actions)
+            _, conds, effects = actions[action[0]]
+
+            failed_condition = find_failed_condition(state, conds, parameters)
+            if failed_condition is not None:
+                expected = failed_condition.target_value
+                expected = parameters.get(expected, expected) if type(expected) is str else expected
+                message = f"condition {failed_condition.name} failed, expected {failed_condition.src_name}.{failed_condition.var_name} == {expected}"
+                return ValidationResult(valid=False, steps_executed=step, failed_step=step, failed_action=action,
+                                        failed_condition=failed_condition, message=message,
+                                        final_state=state if keep_final_state else None)
+
+            state = apply_action_to_state(state, parameters, effects)
+        except ValueError as e:
+            return ValidationResult(valid=False, steps_executed=step, failed_step=step, failed_action=action,
+                                    message=str(e), final_state=state if keep_final_state else None)
+
+    if require_goal and not goal_holds(state, goal_state):
+        unmet = [goal_key for goal_key, goal_value in goal_state.items() if state.get(goal_key) != goal_value]
+        return ValidationResult(valid=False, steps_executed=len(plan), message=f"goal not reached, unmet: {unmet}",
+                                final_state=state if keep_final_state else None)
+
+    return ValidationResult(valid=True, steps_executed=len(plan), final_state=state if keep_final_state else None)
+
+# Validation state lives at module level so that pool workers receive the problem once through the initializer
+_validation_context: Dict[str, Any] = {}
+
+def init_validation_worker(start_state: State, goal_state: State, actions: ActionSchemas, require_goal: bool) -> None:
+    _validation_context['start_state'] = start_state
+    _validation_context['goal_state'] = goal_state
+    _validation_context['actions'] = actions
+    _validation_context['require_goal'] = require_goal
+
+def worker_validate(plans: List[List[Action]]) -> List[ValidationResult]:
+    return [validate_in_state(plan, _validation_context['start_state'], _validation_context['goal_state'],
+                              _validation_context['actions'], _validation_context['require_goal']) for plan in plans]
+
+def validate_plans(plans: List[List[Action]], domain: Domain, start_state: State | None = None, require_goal: bool = True,
+                   num_workers: int = 0, chunksize: int = 256) -> List[ValidationResult]:
+    """
+        Validate many plans against the same problem, in order. With num_workers > 0 the plans are split into
+        chunks and validated in a process pool. Final states are not kept in batch mode.
+    """
+    start_state = domain.states[0] if start_state is None else start_state
+
+    if num_workers <= 0:
+        return [validate_in_state(plan, start_state, domain.goal_state, domain.actions, require_goal) for plan in plans]
+
+    chunks = [plans[idx:idx + chunksize] for idx in range(0, len(plans), chunksize)]
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_validation_worker,
+                             initargs=(start_state, domain.goal_state, domain.actions, require_goal)) as pool:
+        results = []
+        for chunk_results in pool.map(worker_validate, chunks):
+            results.extend(chunk_results)
+
+    return results
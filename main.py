@@ -1,19 +1,46 @@
+import sys
+
 from eas.EAS import State
-from eas.block_domain import Object, Pose, create_goal_nodes, domain, create_domain_transition_graph
+from eas.block_domain import Object, Pose, create_goal_nodes, create_block_domain, create_domain_transition_graph
 from eas.eas_parser import parse_configs, build_physical_relations
-from planners.basic_planner import solve_dtg_basic
+from planners.basic_planner import solve_dtg_basic, iterate_dtg_basic, PlanNotFound
+from planners.plan_optimizer import optimize_plan
 from dispatcher.dispatcher import CommandDispatcher
+from dispatcher.pipeline import StreamingExecutor
 
-def main():
+def main(stream: bool = True):
     config_name = "stack_2_stack"
     problem_config_path = "config/problem_configs/"
 
-    block_domain = parse_configs(domain, config_name, problem_config_path)
+    block_domain = parse_configs(create_block_domain(), config_name, problem_config_path)
     dtg = create_domain_transition_graph(block_domain)
     goal_nodes = create_goal_nodes(block_domain, dtg)
 
+    # Streaming starts executing the first committed action while the planner is still running,
+    # the full plan is needed for the post-optimisation pass
+    if stream:
+        cd = CommandDispatcher(block_domain)
+        cd.initialize_objects()
+
+        result = StreamingExecutor(cd).run(iterate_dtg_basic(goal_nodes, dtg, block_domain))
+        if result.planner_error is not None:
+            print(f"No plan found 😢 ({result.planner_error}, {len(result.executed)} actions executed)")
+        elif result.time_to_first_action is not None:
+            print(f"Executed {len(result.executed)} actions, first one after {result.time_to_first_action:.3f}s")
+
+        cd.run_simulation([])
+        return
+
     # print(type(list(block_domain.current_state.values())[0]))
-    plan = solve_dtg_basic(goal_nodes, dtg, block_domain)
+    try:
+        plan = solve_dtg_basic(goal_nodes, dtg, block_domain)
+    except PlanNotFound as e:
+        print(f"No plan found 😢 ({e}, {len(e.partial_plan)} actions committed)")
+        return
+
+    plan, report = optimize_plan(plan, block_domain)
+    print(report)
+
     # for step in plan:
     #     print(step)
     cd = CommandDispatcher(block_domain)
@@ -21,4 +48,5 @@ def main():
     cd.run_simulation(plan)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # python main.py [--no-stream]
+    main(stream="--no-stream" not in sys.argv[1:])
\ No newline at end of file
@@ -1,10 +1,12 @@
 import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib import patches
-from typing import List, Tuple, Dict, cast
-from scipy.spatial import KDTree
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+from typing import Any, Callable, List, Tuple, Dict, cast
+from scipy.ndimage import distance_transform_edt
+from scipy.spatial import cKDTree
 
-from eas.EAS import Domain
+from eas.EAS import Domain, State
 from eas.block_domain import Pose, Object, Robot
 
 class OccupancyGridMap:
@@ -15,8 +17,17 @@ class OccupancyGridMap:
         self.grid_limits = grid_limits
         self.grid_size = None
 
-        self.grid = np.array([])
-        self.oc_grid = np.array([])
+        self.occupancy = np.zeros((0, 0), dtype=np.uint8)
+        self.oc_grid = np.array([], dtype=np.uint8)
+
+        # Incremental updates, see follow_domain
+        self.version = 0
+        self.counts = np.zeros((0, 0), dtype=np.uint16) # Number of object stencils covering each cell
+        self.stamped: Dict[str, Pose | None] = {} # object name -> pose its stencil is stamped at
+        self.stencils: Dict[str, np.ndarray] = {} # pose name -> flat indices of the cells within col_margin
+        self.listeners: List[Callable[[np.ndarray], None]] = []
+
+        self.travel_costs: Tuple[str, Any] | None = None # (map key, TravelCosts), see mapping.travel_costs.get_travel_costs
 
         self.poses = cast(List[Pose], domain.things.get(Pose))
         self.objects = cast(List[Object], domain.things.get(Object))
@@ -37,67 +48,228 @@ class OccupancyGridMap:
         return grid_limits
 
     def create_grid(self) -> np.ndarray:
-        grid = np.array([])
+        """
+            Allocate the (nx, ny) occupancy array, one uint8 per cell. Cell (ix, iy) is centred on
+            (min_x + ix * grid_res, min_y + iy * grid_res), coordinates are never stored, see cell_to_world.
+        """
         if self.grid_limits is None:
             raise ValueError("Grid limits not set. Cannot create grid.")
 
-        (min_x, max_x), (min_y, max_y) = self.grid_limits
+        self.grid_size = self.compute_grid_size()
+        self.occupancy = np.zeros(self.grid_size, dtype=np.uint8)
 
-        grid_x = np.arange(min_x, max_x, self.grid_res)
-        grid_y = np.arange(min_y, max_y, self.grid_res)
+        return self.occupancy
 
-        grid = np.meshgrid(
-            grid_x,
-            grid_y
-        )
+    def compute_grid_size(self) -> Tuple[int, int]:
+        """
+            (nx, ny) cell counts of the grid limits. Known before any occupancy is allocated, so cell conversions and
+            the quadtree map work without a dense grid.
+        """
+        (min_x, max_x), (min_y, max_y) = cast(Tuple[Tuple[float, float], Tuple[float, float]], self.grid_limits)
 
-        grid = np.array(grid).T.reshape(-1, 2)
-        self.grid = grid
+        # Same cell count as np.arange(min, max, grid_res)
+        # Flat grid index ix * ny + iy, see path_planner.grid_astar
+        return int(np.ceil((max_x - min_x) / self.grid_res)), int(np.ceil((max_y - min_y) / self.grid_res))
 
-        return self.grid
+    @property
+    def grid(self) -> np.ndarray:
+        """
+            (N, 2) world coordinates of all cells in flat index order. Built on every access, prefer cell_to_world.
+        """
+        if self.grid_size is None:
+            return np.array([])
 
-    def assign_occupancy(self, grid: np.ndarray) -> np.ndarray:
-        grid_tree = KDTree(grid)
-        oc_grid = np.zeros_like(grid[:,0], dtype=int) # 0: free, 1: occupied
+        return self.cell_to_world(np.arange(self.grid_size[0] * self.grid_size[1]))
 
-        for obj in self.objects:
-            obj_pos = cast(Pose, obj.at).pos[:2]
-            occupied_indices = grid_tree.query_ball_point(obj_pos, r=self.col_margin)
-            oc_grid[occupied_indices] = 1
+    def cell_to_world(self, cells: np.ndarray) -> np.ndarray:
+        """
+            World coordinates of the centres of flat cell indices, shape (..., 2).
+        """
+        (min_x, _), (min_y, _) = cast(Tuple[Tuple[float, float], Tuple[float, float]], self.grid_limits)
+        ix, iy = np.divmod(np.asarray(cells), (self.grid_size or self.compute_grid_size())[1])
+        return np.stack([min_x + ix * self.grid_res, min_y + iy * self.grid_res], axis=-1)
+
+    def world_to_cell(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+            (ix, iy) of the cells whose centres are nearest to points of shape (..., 2).
+        """
+        (min_x, _), (min_y, _) = cast(Tuple[Tuple[float, float], Tuple[float, float]], self.grid_limits)
+        nx_cells, ny_cells = self.grid_size or self.compute_grid_size()
+
+        points = np.asarray(points, dtype=float)
+        ix = np.rint((points[..., 0] - min_x) / self.grid_res).astype(np.int64)
+        iy = np.rint((points[..., 1] - min_y) / self.grid_res).astype(np.int64)
+
+        if np.any((ix < 0) | (ix >= nx_cells) | (iy < 0) | (iy >= ny_cells)):
+            raise ValueError(f"Points {points.tolist()} are outside the grid limits {self.grid_limits}")
+
+        return ix, iy
+
+    def assign_occupancy(self, occupancy: np.ndarray) -> np.ndarray:
+        """
+            Rasterise every object into the cell holding its position, then inflate by col_margin with one
+            Euclidean distance transform over the whole map, so the cost is linear in the number of cells.
+            An object is at most half a cell diagonal from the centre of its cell, only the cells within that band
+            around col_margin are checked against the exact object positions, with a k-d tree over the objects.
+        """
+        occupancy[:] = 0
+
+        # Held objects have no pose and occupy nothing
+        placed = [obj for obj in self.objects if obj.at is not None]
+        if placed:
+            obj_points = np.array([cast(Pose, obj.at).pos[:2] for obj in placed])
+            ix, iy = self.world_to_cell(obj_points)
+            occupancy[ix, iy] = 1
 
-        self.oc_grid = oc_grid
+            # Distance of every cell centre to the nearest object cell centre
+            distances = distance_transform_edt(occupancy == 0, sampling=self.grid_res)
+            half_diagonal = self.grid_res * np.sqrt(0.5)
+
+            occupancy[distances <= self.col_margin - half_diagonal] = 1
+
+            band = np.flatnonzero(np.abs(distances - self.col_margin) < half_diagonal)
+            # Nearest object of every band cell, memory stays linear in the band and object counts
+            exact, _ = cKDTree(obj_points).query(self.cell_to_world(band), distance_upper_bound=self.col_margin + 1e-9)
+            occupancy.ravel()[band[exact <= self.col_margin]] = 1
+
+        self.oc_grid = occupancy.ravel() # 0: free, 1: occupied, flat view of occupancy
+        self.version += 1
         return self.oc_grid
 
+    def follow_domain(self) -> None:
+        """
+            Keep the map in sync with the domain: after every state update, only the cells of the objects that moved
+            are cleared and stamped again, instead of rebuilding the map. Stencils are counted per cell, so a cell
+            stays occupied while any object still covers it. Listeners of the map get the cells that changed.
+            Call stop_following once the map is no longer used, the domain keeps it alive until then.
+        """
+        if self.grid_size is None:
+            raise ValueError("Occupancy grid not created. Cannot follow the domain.")
+
+        self.stop_following()
+
+        self.counts = np.zeros(self.grid_size, dtype=np.uint16)
+        self.stamped = {}
+        for obj in self.objects:
+            if obj.at is not None:
+                self.counts.ravel()[self.stencil(obj.at)] += 1
+            self.stamped[obj.name] = obj.at
+
+        self.occupancy[:] = self.counts > 0
+        self.domain.subscribe(self.on_state_update)
+
+    def subscribe(self, listener: Callable[[np.ndarray], None]) -> None:
+        """
+            Register a callback that gets the flat indices of the cells whose occupancy changed.
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[np.ndarray], None]) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def stop_following(self) -> None:
+        self.domain.unsubscribe(self.on_state_update)
+
+    def on_state_update(self, new_state: State) -> None:
+        counts = self.counts.ravel()
+        touched = []
+
+        for obj in self.objects:
+            old_pose, new_pose = self.stamped[obj.name], obj.at
+            if old_pose is new_pose:
+                continue
+
+            if old_pose is not None:
+                cells = self.stencil(old_pose)
+                counts[cells] -= 1
+                touched.append(cells)
+            if new_pose is not None:
+                cells = self.stencil(new_pose)
+                counts[cells] += 1
+                touched.append(cells)
+            self.stamped[obj.name] = new_pose
+
+        if not touched:
+            return
+
+        cells = np.unique(np.concatenate(touched))
+        occupied = (counts[cells] > 0).astype(np.uint8)
+        changed = cells[self.oc_grid[cells] != occupied]
+        self.oc_grid[cells] = occupied
+
+        if changed.size:
+            self.version += 1
+            for listener in self.listeners:
+                listener(changed)
+
+    def stencil(self, pose: Pose) -> np.ndarray:
+        """
+            Flat indices of the cells within col_margin of a pose, cached per pose.
+        """
+        if pose.name not in self.stencils:
+            nx_cells, ny_cells = cast(Tuple[int, int], self.grid_size)
+            ix, iy = (int(i) for i in self.world_to_cell(np.array(pose.pos[:2])))
+            reach = int(np.ceil(self.col_margin / self.grid_res)) + 1
+
+            xs = np.arange(max(0, ix - reach), min(nx_cells, ix + reach + 1))
+            ys = np.arange(max(0, iy - reach), min(ny_cells, iy + reach + 1))
+            cells = (xs[:, None] * ny_cells + ys[None]).ravel()
+
+            distances = np.linalg.norm(self.cell_to_world(cells) - np.array(pose.pos[:2]), axis=1)
+            self.stencils[pose.name] = cells[distances <= self.col_margin]
+
+        return self.stencils[pose.name]
+
     def create_occupancy_grid_map(self) -> np.ndarray:
-        grid = self.create_grid()
-        oc_grid = self.assign_occupancy(grid)
+        occupancy = self.create_grid()
+        oc_grid = self.assign_occupancy(occupancy)
 
         self.oc_grid_map = oc_grid
         return self.oc_grid_map
 
-    def plot_occupancy_grid_map(self, grid: np.ndarray, oc_grid: np.ndarray) -> None:
-        if self.grid_limits is None:
-            raise ValueError("Grid limits not set. Cannot plot grid.")
-
+    def plot_occupancy_grid_map(self, paths: List[np.ndarray] | None = None) -> Axes:
+        """
+            Draw the map into a new pyplot figure, for interactive use with plt.show().
+        """
         plt.figure(figsize=(8, 8))
+        ax = plt.gca()
+        self.draw_occupancy_grid_map(ax, paths)
+        return ax
+
+    def save_occupancy_grid_map(self, file_path: str, paths: List[np.ndarray] | None = None, dpi: int = 100) -> None:
+        """
+            Render the map straight to an image file without pyplot, so it works headless and from worker threads.
+        """
+        fig = Figure(figsize=(8, 8))
+        self.draw_occupancy_grid_map(fig.add_subplot(), paths)
+        fig.savefig(file_path, dpi=dpi)
+
+    def draw_occupancy_grid_map(self, ax: Axes, paths: List[np.ndarray] | None = None) -> None:
+        """
+            The occupancy array is a single image, objects and paths are vector layers on top of it.
+        """
+        if self.grid_limits is None or self.grid_size is None:
+            raise ValueError("Grid not created. Cannot plot grid.")
 
         (min_x, max_x), (min_y, max_y) = self.grid_limits
+        nx_cells, ny_cells = self.grid_size
+        half = self.grid_res / 2
+        extent = (min_x - half, min_x + (nx_cells - 1) * self.grid_res + half, min_y - half, min_y + (ny_cells - 1) * self.grid_res + half)
 
-        for point, occ in zip(grid, oc_grid):
-            color = 'black' if occ == 1 else 'white'
-            rect = patches.Rectangle((point[0]-self.grid_res/2, point[1]-self.grid_res/2),
-                                     self.grid_res, self.grid_res, linewidth=0.5, edgecolor='gray', facecolor=color)
-            plt.gca().add_patch(rect)
+        # occupancy is indexed [ix, iy], images are indexed [row (y), column (x)]
+        ax.imshow(self.occupancy.T, origin='lower', extent=extent, cmap='gray_r', vmin=0, vmax=1, interpolation='nearest')
 
-        for obj in self.objects:
-            obj_pos = cast(Pose, obj.at).pos[:2]
-            rect = patches.Rectangle((obj_pos[0]-self.grid_res/2, obj_pos[1]-self.grid_res/2),
-                                     self.grid_res, self.grid_res, linewidth=0.5, edgecolor='gray', facecolor='red')
-            plt.gca().add_patch(rect)
-
-        plt.xlim(min_x, max_x)
-        plt.ylim(min_y, max_y)
-        plt.gca().set_aspect('equal', adjustable='box')
-        plt.title("Occupancy Grid Map")
-        plt.xlabel("X")
-        plt.ylabel("Y")
\ No newline at end of file
+        obj_points = np.array([obj.at.pos[:2] for obj in self.objects if obj.at is not None]).reshape(-1, 2)
+        ax.scatter(obj_points[:, 0], obj_points[:, 1], marker='s', color='red', zorder=2)
+
+        for path in paths or []:
+            if len(path):
+                ax.plot(path[:, 0], path[:, 1], color='red', zorder=3)
+
+        ax.set_xlim(min_x, max_x)
+        ax.set_ylim(min_y, max_y)
+        ax.set_aspect('equal', adjustable='box')
+        ax.set_title("Occupancy Grid Map")
+        ax.set_xlabel("X")
+        ax.set_ylabel("Y")
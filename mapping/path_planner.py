@@ -1,8 +1,9 @@
+import heapq
+import math
 import numpy as np
 import matplotlib.pyplot as plt
 import networkx as nx
 
-from networkx.algorithms.shortest_paths import astar_path
 from typing import List, Tuple, Dict, cast
 from mapping.oc_map import OccupancyGridMap
 from scipy.spatial import KDTree
@@ -35,31 +36,253 @@ def dist(a: Tuple[float, float], b: Tuple[float, float]) -> float:
     return np.linalg.norm(np.array(a) - np.array(b)).item()
 
 def astar(g: nx.Graph, oc_grid: np.ndarray, start: Tuple[float, float], goal: Tuple[float, float]) -> np.ndarray:
-    path = np.array([])
-    graph_tree = KDTree(list(g.nodes))
+    """
+        Single query on a graph from create_nx_nodes. The graph is left unchanged, use a PathService to
+        answer several queries on the same map without rebuilding the spatial index.
+    """
+    return PathService(g, oc_grid).path(start, goal)
 
-    if start not in g.nodes:
-        g.add_node(start)
+class PathService:
+    """
+        Answers (start, goal) path queries on a graph from create_nx_nodes. The node list and the KDTree over it
+        are built once. Start and goal are linked to their 8 nearest free nodes for the duration of a query only,
+        so the shared graph is never modified and concurrent queries from several threads are safe.
+    """
+    def __init__(self, g: nx.Graph, oc_grid: np.ndarray):
+        self.graph = g
+        self.nodes: List[Tuple[float, float]] = list(g.nodes)
+        self.node_occupied = np.asarray(oc_grid) == 1
+        self.tree = KDTree(self.nodes)
 
-    if goal not in g.nodes:
-        g.add_node(goal)
+        if len(self.nodes) != len(self.node_occupied):
+            raise ValueError(f"Graph has {len(self.nodes)} nodes but the occupancy grid has {len(self.node_occupied)} cells")
 
-    start_neighbor_idx = graph_tree.query(start, k=8)[1]
-    goal_neighbor_idx = graph_tree.query(goal, k=8)[1]
+    @classmethod
+    def from_map(cls, ocm: OccupancyGridMap) -> 'PathService':
+        return cls(create_nx_nodes(ocm), ocm.oc_grid)
 
-    for s_idx in start_neighbor_idx: #type: ignore
-        s_neighbor = tuple(list(g.nodes)[s_idx])
-        if s_neighbor == start or oc_grid[s_idx] == 1:
-            continue
+    def path(self, start: Tuple[float, float], goal: Tuple[float, float]) -> np.ndarray:
+        return self.paths([(start, goal)])[0]
+
+    def paths(self, pairs: List[Tuple[Tuple[float, float], Tuple[float, float]]]) -> List[np.ndarray]:
+        """
+            Paths for many (start, goal) pairs. The nearest nodes of all endpoints are found with a single KDTree query.
+            Raises networkx.NetworkXNoPath if a goal cannot be reached.
+        """
+        if not pairs:
+            return []
+
+        endpoints = [tuple(map(float, point)) for pair in pairs for point in pair]
+        neighbor_idx = self.tree.query(endpoints, k=8)[1]
+
+        paths = []
+        for pair_idx in range(len(pairs)):
+            start, goal = endpoints[2 * pair_idx], endpoints[2 * pair_idx + 1]
+            start_links = self.terminal_links(start, neighbor_idx[2 * pair_idx])
+            goal_links = self.terminal_links(goal, neighbor_idx[2 * pair_idx + 1])
+            paths.append(np.array(self.search(start, goal, start_links, goal_links)))
+
+        return paths
+
+    def terminal_links(self, terminal: Tuple[float, float], neighbor_idx: np.ndarray) -> Dict[Tuple[float, float], float]:
+        links = {}
+        for idx in neighbor_idx:
+            neighbor = self.nodes[idx]
+            if neighbor == terminal or self.node_occupied[idx]:
+                continue
+            links[neighbor] = dist(terminal, neighbor)
+
+        return links
+
+    def search(self, start: Tuple[float, float], goal: Tuple[float, float], start_links: Dict[Tuple[float, float], float],
+               goal_links: Dict[Tuple[float, float], float]) -> List[Tuple[float, float]]:
+        # All search state is local to the call, the graph is only read
+        adjacency = self.graph.adj
+        g_score = {start: 0.0}
+        parent: Dict[Tuple[float, float], Tuple[float, float] | None] = {start: None}
+        closed = set()
+        open_heap = [(dist(start, goal), 0, start)]
+        counter = 1 # Heap tie breaker, nodes themselves are never compared
+
+        while open_heap:
+            _, _, node = heapq.heappop(open_heap)
+            if node == goal:
+                path = [node]
+                while parent[path[-1]] is not None:
+                    path.append(cast(Tuple[float, float], parent[path[-1]]))
+                return path[::-1]
+
+            if node in closed:
+                continue
+            closed.add(node)
+
+            neighbors = [(neighbor, attrs['cost']) for neighbor, attrs in adjacency[node].items()] if node in adjacency else []
+            if node == start:
+                neighbors.extend(start_links.items())
+            if node in goal_links:
+                neighbors.append((goal, goal_links[node]))
+
+            for neighbor, cost in neighbors:
+                if neighbor in closed:
+                    continue
+
+                n_g = g_score[node] + float(cost)
+                if n_g < g_score.get(neighbor, np.inf):
+                    g_score[neighbor] = n_g
+                    parent[neighbor] = node
+                    heapq.heappush(open_heap, (n_g + dist(neighbor, goal), counter, neighbor))
+                    counter += 1
+
+        raise nx.NetworkXNoPath(f"No path between {start} and {goal}")
+
+GRID_NEIGHBORS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+def grid_astar(ocm: OccupancyGridMap, start: Tuple[float, float], goal: Tuple[float, float]) -> np.ndarray:
+    """
+        A* over the 8-connected occupancy grid itself, without building a graph. Cells are flat indices into
+        ocm.oc_grid, neighbours come from index arithmetic and the open list is a heap of (f, index) pairs.
+        The cells of start and goal may be occupied, the robot is allowed to leave and enter them.
+        Returns the path as world points from start to goal, or an empty array if the goal is unreachable.
+    """
+    if ocm.grid_size is None:
+        raise ValueError("Grid not created. Cannot plan a path.")
+
+    nx_cells, ny_cells = ocm.grid_size
+    res = ocm.grid_res
+
+    # Search on a copy padded with a ring of blocked cells, so neighbour indices never need bounds checks
+    stride = ny_cells + 2
+    blocked = np.ones((nx_cells + 2, stride), dtype=bool)
+    blocked[1:-1, 1:-1] = ocm.oc_grid.reshape(nx_cells, ny_cells) != 0
+    blocked = blocked.ravel()
+
+    cell_ix, cell_iy = ocm.world_to_cell(np.array([start, goal]))
+    (start_ix, goal_ix), (start_iy, goal_iy) = cell_ix.tolist(), cell_iy.tolist()
+    start_idx = (start_ix + 1) * stride + start_iy + 1
+    goal_idx = (goal_ix + 1) * stride + goal_iy + 1
+    blocked[goal_idx] = False
 
-        g.add_edge(start, s_neighbor, cost=np.linalg.norm(np.array(start) - np.array(s_neighbor)))
+    g_score = np.full(blocked.size, np.inf)
+    parent = np.full(blocked.size, -1, dtype=np.int64)
+    closed = np.zeros(blocked.size, dtype=bool)
 
-    for g_idx in goal_neighbor_idx: #type: ignore
-        g_neighbor = tuple(list(g.nodes)[g_idx])
-        if g_neighbor == goal or oc_grid[g_idx] == 1:
+    steps = [(dx * stride + dy, res * math.sqrt(2) if dx and dy else res) for dx, dy in GRID_NEIGHBORS]
+    diagonal_extra = math.sqrt(2) - 1
+
+    def heuristic(idx: int) -> float:
+        # Octile distance, exact on an empty 8-connected grid
+        ix, iy = divmod(idx, stride)
+        dx, dy = abs(ix - goal_ix - 1), abs(iy - goal_iy - 1)
+        return res * (max(dx, dy) + diagonal_extra * min(dx, dy))
+
+    g_score[start_idx] = 0.0
+    open_heap = [(heuristic(start_idx), start_idx)]
+
+    while open_heap:
+        _, idx = heapq.heappop(open_heap)
+        if closed[idx]:
             continue
-        g.add_edge(goal, g_neighbor, cost=np.linalg.norm(np.array(goal) - np.array(g_neighbor)))
+        if idx == goal_idx:
+            break
+        closed[idx] = True
+
+        g = g_score[idx]
+        for offset, cost in steps:
+            n_idx = idx + offset
+            if blocked[n_idx] or closed[n_idx]:
+                continue
+
+            n_g = g + cost
+            if n_g < g_score[n_idx]:
+                g_score[n_idx] = n_g
+                parent[n_idx] = idx
+                heapq.heappush(open_heap, (n_g + heuristic(n_idx), n_idx))
+
+    if not np.isfinite(g_score[goal_idx]):
+        return np.array([])
+
+    cells = [goal_idx]
+    while cells[-1] != start_idx:
+        cells.append(int(parent[cells[-1]]))
+    cells.reverse()
+
+    # Back from padded to ocm.oc_grid indices
+    ix, iy = np.divmod(np.array(cells), stride)
+    path = [tuple(point) for point in ocm.cell_to_world((ix - 1) * ny_cells + iy - 1)]
+    if not np.allclose(path[0], start):
+        path.insert(0, tuple(start))
+    if not np.allclose(path[-1], goal):
+        path.append(tuple(goal))
+
+    return np.array(path)
+
+def octile_distance(dx: np.ndarray, dy: np.ndarray, res: float) -> np.ndarray:
+    dx, dy = np.abs(dx), np.abs(dy)
+    return res * (np.maximum(dx, dy) + (math.sqrt(2) - 1) * np.minimum(dx, dy))
+
+class GridPathCache:
+    """
+        grid_astar paths cached per (start, goal) on a map that follows the domain, see OccupancyGridMap.follow_domain.
+        When cells change, only the cached paths they can affect are dropped: paths crossing a newly occupied cell,
+        and paths that a newly freed cell could shorten, judged by the octile distance through that cell.
+        Queries never rebuild the map.
+    """
+    def __init__(self, ocm: OccupancyGridMap):
+        self.ocm = ocm
+        self.paths: Dict[Tuple[Tuple[float, float], Tuple[float, float]], np.ndarray] = {}
+        self.path_cells: Dict[Tuple[Tuple[float, float], Tuple[float, float]], np.ndarray] = {} # flat indices, start to goal
+        self.path_costs: Dict[Tuple[Tuple[float, float], Tuple[float, float]], float] = {} # inf if unreachable
+        self.invalidated = 0
+
+        ocm.subscribe(self.on_map_update)
+
+    def close(self) -> None:
+        """
+            Stop listening to the map, the cached paths stay readable but are no longer invalidated.
+        """
+        self.ocm.unsubscribe(self.on_map_update)
+
+    def path(self, start: Tuple[float, float], goal: Tuple[float, float]) -> np.ndarray:
+        key = (tuple(map(float, start)), tuple(map(float, goal)))
+        if key in self.paths:
+            return self.paths[key]
+
+        path = grid_astar(self.ocm, start, goal)
+        ny_cells = cast(Tuple[int, int], self.ocm.grid_size)[1]
+
+        if path.size:
+            ix, iy = self.ocm.world_to_cell(path)
+            cost = float(np.sum(np.hypot(np.diff(ix), np.diff(iy)))) * self.ocm.grid_res
+        else:
+            ix, iy = self.ocm.world_to_cell(np.array([start, goal]))
+            cost = np.inf
+
+        self.paths[key] = path
+        self.path_cells[key] = ix * ny_cells + iy
+        self.path_costs[key] = cost
+        return path
+
+    def on_map_update(self, cells: np.ndarray) -> None:
+        ny_cells = cast(Tuple[int, int], self.ocm.grid_size)[1]
+        now_occupied = self.ocm.oc_grid[cells] != 0
+        occupied, freed = cells[now_occupied], cells[~now_occupied]
+        freed_ix, freed_iy = np.divmod(freed, ny_cells)
+
+        stale = []
+        for key, path_cells in self.path_cells.items():
+            # grid_astar may leave and enter occupied start and goal cells
+            inner = path_cells[(path_cells != path_cells[0]) & (path_cells != path_cells[-1])]
+            if occupied.size and np.isin(inner, occupied).any():
+                stale.append(key)
+                continue
 
-    path = np.array(astar_path(g, start, goal, heuristic=dist, weight='cost'))
+            if freed.size:
+                (start_ix, goal_ix), (start_iy, goal_iy) = np.divmod(path_cells[[0, -1]], ny_cells)
+                through_freed = (octile_distance(freed_ix - start_ix, freed_iy - start_iy, self.ocm.grid_res) +
+                                 octile_distance(goal_ix - freed_ix, goal_iy - freed_iy, self.ocm.grid_res))
+                if through_freed.min() < self.path_costs[key] - 1e-9:
+                    stale.append(key)
 
-    return path
\ No newline at end of file
+        for key in stale:
+            del self.paths[key], self.path_cells[key], self.path_costs[key]
+        self.invalidated += len(stale)
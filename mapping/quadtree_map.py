@@ -0,0 +1,376 @@
+import heapq
+import math
+import numpy as np
+
+from typing import Dict, List, Tuple, cast
+from scipy.spatial import cKDTree
+
+from eas.block_domain import Pose
+from mapping.oc_map import OccupancyGridMap
+from mapping.path_planner import GRID_NEIGHBORS
+
+MIXED = 2 # Node code of a quadtree node that is neither all free (0) nor all occupied (1)
+TILE_LEVEL = 6 # Blocks of up to 2^TILE_LEVEL cells a side are rasterised and merged bottom-up
+
+def spread_bits(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values).astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)]:
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+def morton_codes(ix: np.ndarray, iy: np.ndarray) -> np.ndarray:
+    """
+        Z-order codes of cells. Every aligned 2^l x 2^l block is one contiguous range of codes.
+    """
+    return (spread_bits(ix) << np.uint64(1)) | spread_bits(iy)
+
+Leaves = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray] # (x0, y0, level, occupied) of every leaf
+
+def pyramid_leaves(codes: np.ndarray) -> Tuple[int, Leaves]:
+    """
+        Quadtree of a dense block of cell codes, built bottom-up from a pyramid of node codes. Odd sizes are padded with
+        occupied cells. Returns the code of the whole block and its leaves, which are the uniform children of mixed nodes
+        and empty if the whole block is uniform.
+    """
+    levels = [codes.astype(np.int8)]
+    while levels[-1].shape != (1, 1):
+        codes = levels[-1]
+        pad = ((0, codes.shape[0] % 2), (0, codes.shape[1] % 2))
+        codes = np.pad(codes, pad, constant_values=1)
+
+        a, b, c, d = codes[0::2, 0::2], codes[1::2, 0::2], codes[0::2, 1::2], codes[1::2, 1::2]
+        uniform = (a == b) & (a == c) & (a == d) & (a != MIXED)
+        levels.append(np.where(uniform, a, MIXED).astype(np.int8))
+
+    empty = np.zeros(0, dtype=np.int64)
+    x0, y0, level, occupied = [empty], [empty], [empty], [empty.astype(bool)]
+    for depth in range(len(levels) - 1):
+        codes = levels[depth]
+        parent_i, parent_j = np.nonzero(levels[depth + 1] == MIXED)
+        for di in (0, 1):
+            for dj in (0, 1):
+                i, j = 2 * parent_i + di, 2 * parent_j + dj
+                inside = (i < codes.shape[0]) & (j < codes.shape[1])
+                i, j = i[inside], j[inside]
+                child_codes = codes[i, j]
+                leaf = child_codes != MIXED
+
+                x0.append(i[leaf] << depth)
+                y0.append(j[leaf] << depth)
+                level.append(np.full(leaf.sum(), depth))
+                occupied.append(child_codes[leaf] == 1)
+
+    leaves = (np.concatenate(x0).astype(np.int64), np.concatenate(y0).astype(np.int64),
+              np.concatenate(level).astype(np.int64), np.concatenate(occupied).astype(bool))
+    return int(levels[-1][0, 0]), leaves
+
+class QuadTreeMap:
+    """
+        Quadtree over the cells of an OccupancyGridMap. Square blocks that are all free or all occupied are merged into
+        one leaf, so the mostly empty space of a large map costs a handful of leaves. The tree is built from the object
+        positions and the map's col_margin, the dense occupancy array of the map is never needed or allocated.
+        Leaves are stored in Z-order as flat arrays, a cell is located with one binary search over their Morton codes.
+
+        Paths are planned hierarchically: A* over the adjacency graph of free leaves gives a coarse path, which is refined
+        only along its corridor of leaves, by string pulling over the entry and exit cells of each leaf. The result is an
+        any-angle path of world points instead of a cell sequence. Like grid_astar, the cells of start and goal may be occupied.
+    """
+    def __init__(self, ocm: OccupancyGridMap):
+        self.ocm = ocm
+        self.grid_size = ocm.grid_size or ocm.compute_grid_size()
+        self.grid_res = ocm.grid_res
+        self.col_margin = ocm.col_margin
+
+        # Held objects have no pose and occupy nothing
+        self.object_points = np.array([cast(Pose, obj.at).pos[:2] for obj in ocm.objects if obj.at is not None]).reshape(-1, 2)
+        self.object_tree = cKDTree(self.object_points) if len(self.object_points) else None
+
+        self.build_leaves()
+        self.build_adjacency()
+
+    def build_leaves(self) -> None:
+        """
+            Recursive subdivision of the power of two square holding the map. A block no object footprint reaches is a free
+            leaf and a block inside a single footprint an occupied one, without looking at its cells. Other blocks are split,
+            down to tiles of 2^TILE_LEVEL cells, which are rasterised against the footprints near them and merged bottom-up.
+            Cells outside the map count as occupied, so the leaves are those of pyramid_leaves over the dense map.
+        """
+        nx_cells, ny_cells = self.grid_size
+        root_level = (max(nx_cells, ny_cells) - 1).bit_length()
+
+        parts: List[Leaves] = []
+        code = self.build_block(0, 0, root_level, parts)
+        if code != MIXED:
+            parts.append(self.block_leaf(0, 0, root_level, code))
+
+        x0_arr, y0_arr, level, occupied = (np.concatenate(arrays) for arrays in zip(*parts))
+        order = np.argsort(morton_codes(x0_arr, y0_arr))
+
+        self.x0, self.y0 = x0_arr[order], y0_arr[order]
+        self.size = (np.int64(1) << level)[order]
+        self.occupied = occupied[order]
+        self.codes = morton_codes(self.x0, self.y0)
+        # Centres in cell units, leaves on the map border are clipped to the map
+        self.centers = np.stack([(self.x0 + np.minimum(self.x0 + self.size, nx_cells) - 1) / 2,
+                                 (self.y0 + np.minimum(self.y0 + self.size, ny_cells) - 1) / 2], axis=1)
+
+    def build_block(self, x0: int, y0: int, level: int, parts: List[Leaves]) -> int:
+        """
+            Code of the block of 2^level cells a side at (x0, y0). The leaves of a mixed block are appended to parts,
+            a uniform block is left to its parent, which merges it with uniform siblings of the same code.
+        """
+        nx_cells, ny_cells = self.grid_size
+        if x0 >= nx_cells or y0 >= ny_cells:
+            return 1 # Outside the map, like the padding of pyramid_leaves
+
+        size = 1 << level
+        max_ix, max_iy = min(x0 + size, nx_cells) - 1, min(y0 + size, ny_cells) - 1
+        near, covered = self.footprints_near(x0, y0, max_ix, max_iy)
+
+        if covered:
+            return 1
+        if near.size == 0 and max_ix - x0 + 1 == size and max_iy - y0 + 1 == size:
+            return 0
+
+        if level <= TILE_LEVEL:
+            code, (leaf_x0, leaf_y0, leaf_level, leaf_occupied) = pyramid_leaves(self.rasterise(x0, y0, size, near))
+            # Leaves of the padding are dropped, those overlapping the map are kept whole as in pyramid_leaves
+            inside = (leaf_x0 + x0 < nx_cells) & (leaf_y0 + y0 < ny_cells)
+            if code == MIXED:
+                parts.append((leaf_x0[inside] + x0, leaf_y0[inside] + y0, leaf_level[inside], leaf_occupied[inside]))
+            return code
+
+        half = size // 2
+        children = [(x0 + dx, y0 + dy) for dx in (0, half) for dy in (0, half)]
+        child_parts: List[Leaves] = []
+        codes = [self.build_block(child_x0, child_y0, level - 1, child_parts) for child_x0, child_y0 in children]
+
+        if codes[0] != MIXED and all(code == codes[0] for code in codes):
+            return codes[0]
+
+        parts.extend(child_parts)
+        for (child_x0, child_y0), code in zip(children, codes):
+            if code != MIXED and child_x0 < nx_cells and child_y0 < ny_cells:
+                parts.append(self.block_leaf(child_x0, child_y0, level - 1, code))
+        return MIXED
+
+    def block_leaf(self, x0: int, y0: int, level: int, code: int) -> Leaves:
+        return np.array([x0]), np.array([y0]), np.array([level]), np.array([code == 1])
+
+    def footprints_near(self, min_ix: int, min_iy: int, max_ix: int, max_iy: int) -> Tuple[np.ndarray, bool]:
+        """
+            Objects whose footprint, the disc of radius col_margin, reaches a cell centre of the block, found with
+            the k-d tree over the objects and a point to box distance. Also whether one of them covers all the cells.
+        """
+        if self.object_tree is None:
+            return np.zeros(0, dtype=np.int64), False
+
+        (min_x, _), (min_y, _) = cast(Tuple[Tuple[float, float], Tuple[float, float]], self.ocm.grid_limits)
+        low = np.array([min_x + min_ix * self.grid_res, min_y + min_iy * self.grid_res])
+        high = np.array([min_x + max_ix * self.grid_res, min_y + max_iy * self.grid_res])
+        half_diagonal = float(np.linalg.norm(high - low)) / 2
+
+        candidates = np.array(self.object_tree.query_ball_point((low + high) / 2, self.col_margin + half_diagonal + 1e-9), dtype=np.int64)
+        points = self.object_points[candidates]
+
+        # Rounding only errs towards rasterising a block, never towards a wrong uniform code
+        box_distances = np.linalg.norm(np.maximum(np.maximum(low - points, points - high), 0.0), axis=1)
+        near = candidates[box_distances <= self.col_margin + 1e-9]
+        corner_distances = np.linalg.norm(np.maximum(np.abs(points - low), np.abs(points - high)), axis=1)
+        covered = bool(np.any(corner_distances <= self.col_margin - 1e-9))
+
+        return near, covered
+
+    def rasterise(self, x0: int, y0: int, size: int, near: np.ndarray) -> np.ndarray:
+        """
+            Dense codes of one tile, occupied where a cell centre is within col_margin of a nearby object.
+        """
+        nx_cells, ny_cells = self.grid_size
+        (min_x, _), (min_y, _) = cast(Tuple[Tuple[float, float], Tuple[float, float]], self.ocm.grid_limits)
+        codes = np.ones((size, size), dtype=np.int8)
+
+        xs = min_x + np.arange(x0, min(x0 + size, nx_cells)) * self.grid_res
+        ys = min_y + np.arange(y0, min(y0 + size, ny_cells)) * self.grid_res
+        occupied = np.zeros((xs.size, ys.size), dtype=bool)
+        for px, py in self.object_points[near]:
+            occupied |= np.sqrt((xs[:, None] - px) ** 2 + (ys[None] - py) ** 2) <= self.col_margin
+
+        codes[:xs.size, :ys.size] = occupied
+        return codes
+
+    def build_adjacency(self) -> None:
+        """
+            CSR adjacency of free leaves, 8-connected like the grid: every free leaf is linked to the free leaves holding
+            the cells just outside its sides and corners. Edge costs are distances between leaf centres.
+        """
+        free = np.flatnonzero(~self.occupied)
+        x0, y0, size = self.x0[free], self.y0[free], self.size[free]
+
+        owner = np.repeat(free, size)
+        offset = np.arange(owner.size) - np.repeat(np.cumsum(size) - size, size)
+        sx, sy, ss = np.repeat(x0, size), np.repeat(y0, size), np.repeat(size, size)
+
+        sample_x = np.concatenate([sx - 1, sx + ss, sx + offset, sx + offset, x0 - 1, x0 - 1, x0 + size, x0 + size])
+        sample_y = np.concatenate([sy + offset, sy + offset, sy - 1, sy + ss, y0 - 1, y0 + size, y0 - 1, y0 + size])
+        src = np.concatenate([owner] * 4 + [free] * 4)
+
+        nx_cells, ny_cells = self.grid_size
+        inside = (sample_x >= 0) & (sample_x < nx_cells) & (sample_y >= 0) & (sample_y < ny_cells)
+        src, dst = src[inside], self.leaf_of(sample_x[inside], sample_y[inside])
+
+        linked = ~self.occupied[dst]
+        pairs = np.unique(src[linked] * len(self.codes) + dst[linked])
+        src, dst = np.divmod(pairs, len(self.codes))
+
+        self.indptr = np.searchsorted(src, np.arange(len(self.codes) + 1))
+        self.indices = dst
+        self.costs = np.linalg.norm(self.centers[src] - self.centers[dst], axis=1) * self.grid_res
+
+    def leaf_of(self, ix: np.ndarray, iy: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.codes, morton_codes(ix, iy), side='right') - 1
+
+    def path(self, start: Tuple[float, float], goal: Tuple[float, float]) -> np.ndarray:
+        """
+            Path as world points from start to goal, or an empty array if the goal is unreachable.
+        """
+        cell_ix, cell_iy = self.ocm.world_to_cell(np.array([start, goal]))
+        start_cell, goal_cell = (int(cell_ix[0]), int(cell_iy[0])), (int(cell_ix[1]), int(cell_iy[1]))
+
+        coarse = self.coarse_path(start_cell, goal_cell)
+        if coarse is None:
+            return np.array([])
+
+        waypoints = self.pull_string(self.corridor_waypoints(start_cell, goal_cell, coarse), start_cell, goal_cell)
+
+        (min_x, _), (min_y, _) = cast(Tuple[Tuple[float, float], Tuple[float, float]], self.ocm.grid_limits)
+        path = [(min_x + ix * self.grid_res, min_y + iy * self.grid_res) for ix, iy in waypoints]
+        if not np.allclose(path[0], start):
+            path.insert(0, tuple(start))
+        if not np.allclose(path[-1], goal):
+            path.append(tuple(goal))
+
+        return np.array(path)
+
+    def terminal_links(self, cell: Tuple[int, int]) -> Dict[int, float]:
+        """
+            Free leaves reachable in one step from a cell, with the distance to their centres.
+        """
+        nx_cells, ny_cells = self.grid_size
+        ix = np.array([cell[0]] + [cell[0] + dx for dx, _ in GRID_NEIGHBORS])
+        iy = np.array([cell[1]] + [cell[1] + dy for _, dy in GRID_NEIGHBORS])
+        inside = (ix >= 0) & (ix < nx_cells) & (iy >= 0) & (iy < ny_cells)
+
+        links = {}
+        for leaf in self.leaf_of(ix[inside], iy[inside]).tolist():
+            if not self.occupied[leaf]:
+                links[leaf] = float(np.linalg.norm(self.centers[leaf] - np.array(cell))) * self.grid_res
+
+        return links
+
+    def coarse_path(self, start_cell: Tuple[int, int], goal_cell: Tuple[int, int]) -> List[int] | None:
+        """
+            A* over the leaf graph, from the start cell to the goal cell. Returns the leaves along the way.
+        """
+        start, goal = -1, -2 # Terminal nodes of the cells themselves
+        start_links, goal_links = self.terminal_links(start_cell), self.terminal_links(goal_cell)
+        goal_point = np.array(goal_cell)
+
+        def heuristic(leaf: int) -> float:
+            return float(np.linalg.norm(self.centers[leaf] - goal_point)) * self.grid_res
+
+        g_score: Dict[int, float] = {start: 0.0}
+        parent: Dict[int, int] = {}
+        closed = set()
+        open_heap = [(0.0, start)]
+
+        while open_heap:
+            _, node = heapq.heappop(open_heap)
+            if node == goal:
+                leaves = []
+                while parent[node] != start:
+                    node = parent[node]
+                    leaves.append(node)
+                return leaves[::-1]
+
+            if node in closed:
+                continue
+            closed.add(node)
+
+            if node == start:
+                neighbors = list(start_links.items())
+            else:
+                neighbors = list(zip(self.indices[self.indptr[node]:self.indptr[node + 1]].tolist(),
+                                     self.costs[self.indptr[node]:self.indptr[node + 1]].tolist()))
+                if node in goal_links:
+                    neighbors.append((goal, goal_links[node]))
+
+            for neighbor, cost in neighbors:
+                if neighbor in closed:
+                    continue
+
+                n_g = g_score[node] + cost
+                if n_g < g_score.get(neighbor, np.inf):
+                    g_score[neighbor] = n_g
+                    parent[neighbor] = node
+                    heapq.heappush(open_heap, (n_g + (0.0 if neighbor == goal else heuristic(neighbor)), neighbor))
+
+        return None
+
+    def leaf_box(self, leaf: int) -> Tuple[int, int, int, int]:
+        nx_cells, ny_cells = self.grid_size
+        x0, y0, size = int(self.x0[leaf]), int(self.y0[leaf]), int(self.size[leaf])
+        return x0, y0, min(x0 + size, nx_cells) - 1, min(y0 + size, ny_cells) - 1
+
+    def corridor_waypoints(self, start_cell: Tuple[int, int], goal_cell: Tuple[int, int], leaves: List[int]) -> List[Tuple[int, int]]:
+        """
+            Cells where the path enters and leaves every leaf of the coarse path. The entry cell of a leaf is the cell of
+            the previous exit clipped into the leaf and vice versa, so consecutive waypoints are either in the same free,
+            convex leaf or neighbouring cells, and the straight segments between them never cross an occupied cell.
+        """
+        def clip(cell: Tuple[int, int], leaf: int) -> Tuple[int, int]:
+            min_ix, min_iy, max_ix, max_iy = self.leaf_box(leaf)
+            return min(max(cell[0], min_ix), max_ix), min(max(cell[1], min_iy), max_iy)
+
+        waypoints = [start_cell, clip(start_cell, leaves[0])]
+        for leaf, next_leaf in zip(leaves[:-1], leaves[1:]):
+            entry = clip(waypoints[-1], next_leaf)
+            waypoints += [clip(entry, leaf), entry]
+        waypoints += [clip(goal_cell, leaves[-1]), goal_cell]
+
+        # Drop repeats, e.g. when start or goal lie inside the first or last leaf
+        return [cell for idx, cell in enumerate(waypoints) if idx == 0 or cell != waypoints[idx - 1]]
+
+    def line_of_sight(self, a: Tuple[int, int], b: Tuple[int, int], ends: Tuple[Tuple[int, int], Tuple[int, int]]) -> bool:
+        """
+            Whether the segment between two cell centres only crosses free cells, sampled ten times per cell.
+            The cells in ends (start and goal, which may be occupied) are ignored.
+        """
+        steps = int(math.ceil(10 * max(abs(b[0] - a[0]), abs(b[1] - a[1])))) + 1
+        t = np.linspace(0.0, 1.0, steps)
+        ix = np.unique(np.rint(a[0] + t * (b[0] - a[0])).astype(np.int64) * self.grid_size[1] +
+                       np.rint(a[1] + t * (b[1] - a[1])).astype(np.int64))
+        ix = ix[(ix != ends[0][0] * self.grid_size[1] + ends[0][1]) & (ix != ends[1][0] * self.grid_size[1] + ends[1][1])]
+
+        cells_ix, cells_iy = np.divmod(ix, self.grid_size[1])
+        return not self.occupied[self.leaf_of(cells_ix, cells_iy)].any()
+
+    def pull_string(self, waypoints: List[Tuple[int, int]], start_cell: Tuple[int, int], goal_cell: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """
+            Greedily skip waypoints while the straight segment to a later one stays free.
+        """
+        pulled = [waypoints[0]]
+        idx = 0
+        while idx < len(waypoints) - 1:
+            next_idx = idx + 1
+            while next_idx + 1 < len(waypoints) and self.line_of_sight(waypoints[idx], waypoints[next_idx + 1], (start_cell, goal_cell)):
+                next_idx += 1
+
+            pulled.append(waypoints[next_idx])
+            idx = next_idx
+
+        return pulled
+
+    def memory_bytes(self) -> int:
+        arrays = [self.x0, self.y0, self.size, self.occupied, self.codes, self.centers, self.indptr, self.indices, self.costs]
+        return sum(array.nbytes for array in arrays)
@@ -0,0 +1,106 @@
+import hashlib
+import numpy as np
+
+from dataclasses import dataclass
+from typing import List, cast
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from eas.block_domain import Pose
+from mapping.oc_map import OccupancyGridMap
+
+@dataclass
+class TravelCosts:
+    """
+        Free-space travel distance between every pair of poses, indexed by pose ID (the order of domain.things[Pose]).
+        Unreachable pairs are inf.
+    """
+    pose_names: List[str]
+    costs: np.ndarray
+
+    def __post_init__(self):
+        self.pose_ids = {pose_name: pose_id for pose_id, pose_name in enumerate(self.pose_names)}
+
+    def cost(self, start_pose: str, target_pose: str) -> float:
+        return float(self.costs[self.pose_ids[start_pose], self.pose_ids[target_pose]])
+
+    def save(self, path: str) -> None:
+        np.savez(path, pose_names=np.array(self.pose_names), costs=self.costs)
+
+    @classmethod
+    def load(cls, path: str) -> 'TravelCosts':
+        with np.load(path) as data:
+            return cls(pose_names=data['pose_names'].tolist(), costs=data['costs'])
+
+def map_key(ocm: OccupancyGridMap) -> str:
+    poses = cast(List[Pose], ocm.poses)
+    content = repr(([(pose.name, tuple(pose.pos)) for pose in poses], ocm.grid_res, ocm.col_margin, ocm.grid_limits, ocm.grid_size))
+    return hashlib.sha1(content.encode() + np.ascontiguousarray(ocm.oc_grid).tobytes()).hexdigest()
+
+def get_travel_costs(ocm: OccupancyGridMap) -> TravelCosts:
+    """
+        Travel costs of the map, cached on the map itself so the table is freed together with its problem.
+        The cached table is checked against map_key, so a map that changed since is recomputed.
+    """
+    key = map_key(ocm)
+    if ocm.travel_costs is None or ocm.travel_costs[0] != key:
+        ocm.travel_costs = (key, compute_travel_costs(ocm))
+
+    return ocm.travel_costs[1]
+
+def compute_travel_costs(ocm: OccupancyGridMap) -> TravelCosts:
+    """
+        One Dijkstra run from every pose over the 8-connected free cells of the occupancy grid, using scipy's csgraph.
+        Poses usually sit inside the inflated footprint of a block, so every pose gets an exit node with edges to
+        the free cells within col_margin + 2 * grid_res of it and an entry node with edges from them. Entry nodes
+        have no outgoing edges, so no path passes through another pose's footprint.
+    """
+    if ocm.grid_size is None or not ocm.oc_grid.size:
+        raise ValueError("Occupancy grid not created. Cannot compute travel costs.")
+
+    nx_cells, ny_cells = ocm.grid_size
+    n_cells = nx_cells * ny_cells
+    free = (ocm.oc_grid.reshape(nx_cells, ny_cells) == 0)
+
+    rows, cols, weights = [], [], []
+    for dx, dy in [(1, -1), (1, 0), (1, 1), (0, 1)]:
+        # Each undirected grid edge once, between cell (ix, iy) and (ix + dx, iy + dy)
+        y_start, y_stop = max(0, -dy), ny_cells - max(0, dy)
+        src = free[:nx_cells - dx, y_start:y_stop]
+        dst = free[dx:, y_start + dy:y_stop + dy]
+        ix, iy = np.nonzero(src & dst)
+        iy = iy + y_start
+
+        src_idx = ix * ny_cells + iy
+        dst_idx = (ix + dx) * ny_cells + iy + dy
+        step = ocm.grid_res * np.hypot(dx, dy)
+
+        rows += [src_idx, dst_idx]
+        cols += [dst_idx, src_idx]
+        weights += [np.full(src_idx.size, step)] * 2
+
+    poses = cast(List[Pose], ocm.poses)
+    free_idx = np.flatnonzero(free.ravel())
+    free_points = ocm.cell_to_world(free_idx)
+    link_radius = ocm.col_margin + 2 * ocm.grid_res
+
+    for pose_id, pose in enumerate(poses):
+        offsets = np.linalg.norm(free_points - np.array(pose.pos[:2]), axis=1)
+        linked = offsets <= link_radius
+        exit_node, entry_node = n_cells + 2 * pose_id, n_cells + 2 * pose_id + 1
+
+        rows += [np.full(linked.sum(), exit_node), free_idx[linked]]
+        cols += [free_idx[linked], np.full(linked.sum(), entry_node)]
+        # csgraph drops explicit zero weights, a pose exactly on a free cell centre still needs its link
+        weights += [np.maximum(offsets[linked], 1e-9)] * 2
+
+    n_nodes = n_cells + 2 * len(poses)
+    graph = coo_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))), shape=(n_nodes, n_nodes)).tocsr()
+
+    exit_nodes = n_cells + 2 * np.arange(len(poses))
+    distances = dijkstra(graph, directed=True, indices=exit_nodes)
+
+    costs = distances[:, exit_nodes + 1]
+    np.fill_diagonal(costs, 0.0)
+
+    return TravelCosts(pose_names=[pose.name for pose in poses], costs=costs)
@@ -0,0 +1,35 @@
+import time
+
+from eas.block_domain import create_block_domain, create_domain_transition_graph, create_goal_nodes
+from eas.eas_parser import parse_configs
+from eas.EAS import replay_plan, goal_holds
+from planners.basic_planner import solve_dtg_basic
+from planners.mcts_planner import MCTSPlanner
+
+def main():
+    problem_config_path = "config/problem_configs/"
+
+    for config_name in ["stacked", "stack_2_stack"]:
+        block_domain = parse_configs(create_block_domain(), config_name, problem_config_path, verbose=False)
+        dtg = create_domain_transition_graph(block_domain)
+        start_state = block_domain.current_state
+
+        greedy_plan = solve_dtg_basic(create_goal_nodes(block_domain, dtg), dtg, block_domain)
+        block_domain.update_state(start_state)
+
+        start = time.perf_counter()
+        with MCTSPlanner(block_domain, dtg, seed=0) as planner:
+            plan = planner.solve(max_steps=60)
+        solve_time = time.perf_counter() - start
+
+        states = replay_plan(start_state, plan, block_domain.actions)
+        assert states is not None
+        assert goal_holds(states[-1], block_domain.goal_state)
+        # Rollouts follow the greedy action values, so the committed plan should not wander far from the greedy one
+        assert len(plan) <= 2 * (len(greedy_plan) - 1)
+
+        print(f"{config_name}: {len(plan)} actions in {solve_time:.1f}s after {planner.total_rollouts} rollouts, "
+              f"greedy plan has {len(greedy_plan) - 1}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from typing import Dict, Tuple, cast
+
+from eas.block_domain import Pose, create_block_domain
+from eas.eas_parser import parse_configs
+from eas.problem_format import PROBLEM_FILE, save_binary_problem
+from mapping.oc_map import OccupancyGridMap
+
+def many_blocks_configs(num_blocks: int, spacing: float = 2.0, stack_height: int = 3) -> Tuple[Dict, Dict]:
+    side = int(np.ceil(np.sqrt(num_blocks / stack_height)))
+    init_config: Dict[str, Dict] = {'robot': {'type': "robot", 'position': [-4.0, -4.0, 0.5], 'orientation': [0.0, 0.0, 0.0]}}
+
+    for block in range(num_blocks):
+        stack, level = divmod(block, stack_height)
+        x, y = float(stack // side) * spacing, float(stack % side) * spacing
+        init_config[f"block{block + 1}"] = {'type': "dynamic" if level else "static", 'position': [x, y, 0.5 + level],
+                                            'orientation': [0.0, 0.0, 0.0], 'color': [1.0, 0.0, 0.0], 'size': 1.0}
+
+    goal_config = {"block2": {'position': [-4.0, 0.0, 0.5], 'orientation': [0.0, 0.0, 0.0]}}
+    return init_config, goal_config
+
+def stamped_occupancy(ocm: OccupancyGridMap) -> np.ndarray:
+    """
+        Reference map: the exact stencil of every placed object, stamped one by one.
+    """
+    occupancy = np.zeros(cast(Tuple[int, int], ocm.grid_size), dtype=np.uint8)
+    for obj in ocm.objects:
+        if obj.at is not None:
+            occupancy.ravel()[ocm.stencil(cast(Pose, obj.at))] = 1
+
+    return occupancy
+
+def main():
+    num_blocks = 2000
+
+    with tempfile.TemporaryDirectory() as problem_config_path:
+        os.makedirs(os.path.join(problem_config_path, "many_blocks"))
+        init_config, goal_config = many_blocks_configs(num_blocks)
+        save_binary_problem(init_config, goal_config, os.path.join(problem_config_path, "many_blocks", PROBLEM_FILE))
+        block_domain = parse_configs(create_block_domain(), "many_blocks", problem_config_path, verbose=False)
+
+    # A margin that is not a multiple of the resolution puts cells on both sides of the band
+    for grid_res, col_margin in [(0.1, 1.0), (0.1, 0.73), (0.25, 1.3)]:
+        ocm = OccupancyGridMap(block_domain, grid_res=grid_res, col_margin=col_margin)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        ocm.create_occupancy_grid_map()
+        build_time = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        reference = stamped_occupancy(ocm)
+        mismatches = int(np.count_nonzero(ocm.occupancy != reference))
+        print(f"{num_blocks} blocks, grid {ocm.grid_size}, res {grid_res}, margin {col_margin}: "
+              f"{build_time:.3f}s, peak {peak / 1e6:.1f} MB, {mismatches} cells differ from the stamped map")
+
+        assert mismatches == 0
+        # The map itself plus the distance transform, nothing that grows with objects times cells
+        assert peak < 40 * ocm.occupancy.size
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+
+from eas.block_domain import create_block_domain, create_domain_transition_graph, create_goal_nodes
+from eas.eas_parser import parse_configs
+from planners.basic_planner import solve_dtg_basic
+from planners.plan_library import PlanLibrary, problem_key
+
+def main():
+    config_name = "stack_2_stack"
+    problem_config_path = "config/problem_configs/"
+
+    block_domain = parse_configs(create_block_domain(), config_name, problem_config_path, verbose=False)
+    dtg = create_domain_transition_graph(block_domain)
+    start_state = block_domain.current_state
+
+    plan = solve_dtg_basic(create_goal_nodes(block_domain, dtg), dtg, block_domain)
+    block_domain.update_state(start_state)
+    key = problem_key(start_state, block_domain.goal_state)
+
+    with tempfile.TemporaryDirectory() as library_dir:
+        library_path = os.path.join(library_dir, "plans.json")
+
+        library = PlanLibrary(library_path)
+        assert library.store(start_state, block_domain.goal_state, plan, block_domain.actions)
+        assert library.lookup(start_state, block_domain.goal_state, block_domain.actions) == plan
+        library.save()
+
+        # A stale library file: the stored plan stops one action short of the goal
+        with open(library_path, 'r') as f:
+            data = json.load(f)
+        data['plans'][key] = data['plans'][key][:-1]
+        with open(library_path, 'w') as f:
+            json.dump(data, f)
+
+        library = PlanLibrary(library_path)
+        assert key in library.plans
+        assert library.lookup(start_state, block_domain.goal_state, block_domain.actions) is None
+
+        # Evicted together with its fragments, later lookups do not replay it again
+        assert key not in library.plans
+        assert all(plan_key != key for plan_key, _ in library.fragments.values())
+        assert library.lookup(start_state, block_domain.goal_state, block_domain.actions) is None
+        assert library.misses == 2
+
+    print(f"Stale plan of {len(plan) - 1} actions evicted after a failed lookup")
+
+if __name__ == "__main__":
+    main()
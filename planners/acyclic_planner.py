@@ -4,17 +4,31 @@ from collections import deque
 from enum import Enum
 
 from eas.block_domain import Pose, Robot, Object, create_goal_nodes
-from eas.EAS import Action, Effect, apply_action, parse_action_params, is_action_applicable, query_nodes
-from eas.EAS import State, Node, Domain, LinkedState, StateStatus, Condition
+from eas.EAS import Action, Effect, apply_action, parse_action_params, is_action_applicable, query_nodes, replay_plan
+from eas.EAS import State, Node, Domain, LinkedState, StateStatus, Condition, CanonicalState, freeze_state
+from eas.symmetry import canonicalize_state
+from eas.encoding import EncodedProblem
+from planners.plan_library import PlanLibrary
+from mapping.travel_costs import TravelCosts
 from typing import Tuple, Dict, cast, List
 
 verbose_levels = Enum('VerboseLevel', 'NONE DEBUG TRACK INFO')
 
 class AcyclicPlanner:
-    def __init__(self, domain: Domain, dtg: Dict[str, Node], verbosity: verbose_levels = verbose_levels.NONE):
+    def __init__(self, domain: Domain, dtg: Dict[str, Node], verbosity: verbose_levels = verbose_levels.NONE, prune_symmetries: bool = True,
+                 plan_library: PlanLibrary | None = None, travel_costs: TravelCosts | None = None):
+        """
+            Without travel costs every action costs 1 and the planner looks for the plan with the fewest actions.
+            With travel costs a move costs the free-space distance between its poses, picks and places are free,
+            and the planner looks for the plan with the shortest travel distance. Blocks in symmetric stacks are no longer
+            interchangeable once distances count, so symmetry pruning is turned off.
+        """
         self.domain = domain
         self.dtg = dtg
         self.verbosity = verbosity
+        self.prune_symmetries = prune_symmetries and travel_costs is None
+        self.plan_library = plan_library
+        self.travel_costs = travel_costs
 
         self.goal_nodes = create_goal_nodes(self.domain, self.dtg)
         self.current_state = self.domain.current_state
@@ -22,19 +36,26 @@ class AcyclicPlanner:
         self.goal_positions = [g_node.values[-1].name for g_node in self.goal_nodes.values()]
 
         self.state_counter = 0
-        self.steps = 0
         self.s0 = LinkedState(state=self.current_state, state_id=self.state_counter)
         self.current_linked_state = self.s0
         self.goal_linked_states = []
+        self.canonical_states: Dict[int, CanonicalState] = {}
 
         robot = domain.things.get(Robot, [])[0]
         self.robot = cast(Robot, robot)
 
     def run_acyclic_planner(self) -> List[LinkedState]:
+        if self.plan_library is not None:
+            plan = self.plan_library.lookup(self.s0.state, self.domain.goal_state, self.domain.actions)
+            if plan is not None:
+                print(f"Plan of {len(plan)} actions found in the plan library.")
+                self.follow_known_plan(self.s0, plan)
+                return self.goal_linked_states
+
         block_pos = self.find_block_positions()
         self.domain_expansion(block_pos)
 
-        shortest_num_steps = np.inf
+        best_cost = np.inf
 
         while self.current_linked_state.branches_to_explore:
             # print(f"{len(self.current_linked_state.branches_to_explore)} branches to explore from state {self.current_linked_state.state_id}.")
@@ -57,17 +78,17 @@ class AcyclicPlanner:
 
             if branching:
                 self.state_counter += 1
-                self.steps += 1
                 self.current_linked_state = self.branch_out(s_new, action, block_pos)
+                if self.current_linked_state.type_ != StateStatus.GOAL:
+                    self.jump_to_known_suffix(best_cost)
                 if self.current_linked_state.type_ == StateStatus.GOAL:
-                    shortest_num_steps = min(self.steps, shortest_num_steps)
+                    best_cost = min(self.current_linked_state.cost, best_cost)
 
-            if self.steps >= shortest_num_steps:
+            if self.current_linked_state.cost >= best_cost:
                 if self.verbosity != verbose_levels.NONE:
                     print("Current path not better than current shortest path, go back to root.")
 
                 self.current_linked_state = self.s0
-                self.steps = 0
                 self.domain.update_state(self.current_linked_state.state)
             elif (not self.current_linked_state.branches_to_explore):
                 if self.verbosity != verbose_levels.NONE:
@@ -78,16 +99,142 @@ class AcyclicPlanner:
             if self.verbosity != verbose_levels.NONE:
                 print("------------------------------------")
 
+        self.store_best_plan()
+
+        return self.goal_linked_states
+
+    def jump_to_known_suffix(self, best_cost: float) -> None:
+        """
+            If the plan library knows a way to the goal from the current state that beats the incumbent,
+            follow it straight to a goal state instead of expanding the branch.
+        """
+        if self.plan_library is None:
+            return
+
+        suffix = self.plan_library.lookup_suffix(self.current_linked_state.state, self.domain.goal_state, self.domain.actions)
+        if suffix is None or self.current_linked_state.cost + self.plan_cost(suffix) >= best_cost:
+            return
+
+        if self.verbosity != verbose_levels.NONE:
+            print(f"Known plan suffix of {len(suffix)} actions from state {self.current_linked_state.state_id}.")
+
+        self.current_linked_state = self.follow_known_plan(self.current_linked_state, suffix)
+        self.domain.update_state(self.current_linked_state.state)
+
+    def follow_known_plan(self, start: LinkedState, plan: List[Action]) -> LinkedState:
+        states = cast(List[State], replay_plan(start.state, plan, self.domain.actions))
+        goal_linked_state = self.link_plan(start, plan, states[1:])
+        print(f"Goal reached at state id {goal_linked_state.state_id}!")
+        return goal_linked_state
+
+    def link_plan(self, start: LinkedState, plan: List[Action], states: List[State]) -> LinkedState:
+        """
+            Append a chain of linked states for a known plan below start and mark its end as a goal state.
+        """
+        linked_state = start
+        for action, state in zip(plan, states):
+            self.state_counter += 1
+            child = LinkedState(state_id=self.state_counter, state=state, parent=(action, linked_state),
+                                cost=linked_state.cost + self.action_cost(action))
+            linked_state.edges.append((action[0], child))
+            linked_state = child
+
+        linked_state.type_ = StateStatus.GOAL
+        self.goal_linked_states.append(linked_state)
+        return linked_state
+
+    def action_cost(self, action: Action) -> float:
+        action_name, args = action
+        if self.travel_costs is None:
+            return 1.0
+        if action_name != 'move':
+            return 0.0
+
+        return self.travel_costs.cost(args[1], args[2])
+
+    def plan_cost(self, plan: List[Action]) -> float:
+        return sum(self.action_cost(action) for action in plan)
+
+    def store_best_plan(self) -> None:
+        if self.plan_library is None or not self.goal_linked_states:
+            return
+
+        self.plan_library.store(self.s0.state, self.domain.goal_state, self.retrace_action_sequence_back_to_root(), self.domain.actions)
+
+    def run_layered_bfs(self, max_depth: int = 20) -> List[LinkedState]:
+        """
+            Breadth-first search one layer at a time over the integer encoding of the problem, for shallow problems
+            with a very high branching factor. Every layer is a 2-D array with one row per state; preconditions are
+            checked for all grounded operators against the whole layer at once and duplicate states are removed by their row bytes.
+            The first goal state found is linked back to s0 so retrace_action_sequence_back_to_root works as usual.
+        """
+        problem = EncodedProblem(self.domain, self.dtg)
+        goal_cols, goal_vals = problem.encode_goal(self.domain.goal_state)
+
+        frontier = problem.encode(self.s0.state)[None]
+        seen = problem.row_keys(frontier)
+        layers: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = [] # (frontier, parent rows, operators) per depth
+
+        for depth in range(max_depth + 1):
+            goal_rows = np.flatnonzero(np.all(frontier[:, goal_cols] == goal_vals, axis=1))
+            if goal_rows.size:
+                print(f"Goal reached at depth {depth}! Total states generated: {self.state_counter}.")
+                self.link_layered_plan(problem, layers, frontier, int(goal_rows[0]))
+                self.store_best_plan()
+                return self.goal_linked_states
+
+            if depth == max_depth:
+                break
+
+            applicable = problem.node_active(frontier)[:, problem.op_node] & problem.applicable(frontier)
+            rows, ops = np.nonzero(applicable)
+            if not rows.size:
+                break
+
+            children = problem.successors(frontier, rows, ops)
+            child_keys = problem.row_keys(children)
+
+            _, first = np.unique(child_keys, return_index=True)
+            first = np.sort(first[~np.isin(child_keys[first], seen)])
+            if not first.size:
+                break
+
+            layers.append((frontier, rows[first], ops[first]))
+            frontier = children[first]
+            seen = np.union1d(seen, child_keys[first])
+            self.state_counter += first.size
+
+            if self.verbosity != verbose_levels.NONE:
+                print(f"Depth {depth + 1}: {first.size} new states from {rows.size} applicable actions.")
+
+        print(f"No goal state within depth {max_depth}. Total states generated: {self.state_counter}.")
         return self.goal_linked_states
 
+    def link_layered_plan(self, problem: EncodedProblem, layers: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                          frontier: np.ndarray, row: int) -> None:
+        rows, ops = [row], []
+        for _, parent_rows, layer_ops in reversed(layers):
+            ops.insert(0, int(layer_ops[rows[0]]))
+            rows.insert(0, int(parent_rows[rows[0]]))
+
+        frontiers = [layer[0] for layer in layers] + [frontier]
+        plan = [problem.operators[op][0] for op in ops]
+        states = [problem.decode(frontiers[depth + 1][rows[depth + 1]]) for depth in range(len(ops))]
+        self.link_plan(self.s0, plan, states)
+
     def retrace_action_sequence_back_to_root(self) -> List[Action]:
-        action_sequence = []
+        """
+            Action sequence from the root to the cheapest goal state. Empty if no goal state was found.
+        """
+        if not self.goal_linked_states:
+            return []
 
-        for state in self.goal_linked_states:
-            while state.parent is not None:
-                action = state.parent[0]
-                action_sequence.insert(0, action)
-                state = state.parent[1]
+        state = min(self.goal_linked_states, key=lambda goal_state: goal_state.cost)
+        action_sequence = []
+        while state.parent is not None:
+            action = state.parent[0]
+            action_sequence.insert(0, action)
+            state = state.parent[1]
 
         return action_sequence
 
@@ -103,10 +250,10 @@ class AcyclicPlanner:
 
             self.current_linked_state = self.current_linked_state.parent[1]
             self.domain.update_state(self.current_linked_state.state)
-            self.steps -= 1
 
     def branch_out(self, s_new: State, action: Action, block_pos: List[str]) -> LinkedState:
-        s_new_linked = LinkedState(self.state_counter, s_new, parent=(action, self.current_linked_state))
+        s_new_linked = LinkedState(self.state_counter, s_new, parent=(action, self.current_linked_state),
+                                   cost=self.current_linked_state.cost + self.action_cost(action))
         self.current_linked_state.edges.append((action[0], s_new_linked))
 
         self.domain.update_state(s_new)
@@ -127,10 +274,18 @@ class AcyclicPlanner:
         self.current_linked_state.branches_to_explore = possible_actions
 
     def is_branching_condition_met(self, s_new: State, action_name: str) -> bool:
+        s_new_canonical = self.canonical_state(s_new)
+
+        for _, sibling in self.current_linked_state.edges:
+            if self.canonical_state(sibling.state, sibling.state_id) == s_new_canonical:
+                if self.verbosity == verbose_levels.DEBUG:
+                    print("New state is symmetric to an already explored sibling state, skipping.")
+                return False
+
         ancestor = self.current_linked_state.parent
         if ancestor:
             ancestor = ancestor[1]
-            if s_new == ancestor.state:
+            if s_new_canonical == self.canonical_state(ancestor.state, ancestor.state_id):
                 if self.verbosity == verbose_levels.DEBUG:
                     print("New state is the same as an ancestor state, skipping to avoid cycle.")
                 branching = False
@@ -145,6 +300,23 @@ class AcyclicPlanner:
 
         return branching
 
+    def canonical_state(self, state: State, state_id: int | None = None) -> CanonicalState:
+        """
+            Canonical form of a state under the domain's block and stack symmetries, cached per linked state id.
+        """
+        if state_id is not None and state_id in self.canonical_states:
+            return self.canonical_states[state_id]
+
+        if self.prune_symmetries:
+            canonical = canonicalize_state(state, self.domain.symmetries)
+        else:
+            canonical = freeze_state(state)
+
+        if state_id is not None:
+            self.canonical_states[state_id] = canonical
+
+        return canonical
+
     def parse_action_from_branch(self, branch: Tuple[Node, str, Node]) -> Tuple[str, Dict, List[Condition], List[Effect], bool]:
         node, action_name, target_node = branch
         action_params = parse_action_params(action_name, node, target_node)
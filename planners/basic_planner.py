@@ -2,167 +2,191 @@ import time
 import numpy as np
 
 from eas.block_domain import Pose, Robot, Object
-from eas.EAS import apply_action, parse_action_params, is_action_applicable, query_current_nodes, query_nodes
-from eas.EAS import State, Node, Domain
-from typing import Tuple, Dict, cast, List
-
-def compute_action_values(domain: Domain, state: State, dtg: Dict[str, Node], node: Node, goal_nodes: Dict[str, Node], actions: Dict[str, Tuple],
-                          current_block_positions: List[Object], goal_blocks: List[Object], goal_positions: List[Pose]) -> List:
-    action_values = []
-    nodes = []
-    verbose = False
-
-    for edge in node.edges:
-        action_name, target = edge
-        action_value = 0
-
-        action = actions.get(action_name)
-
-        if not action:
-            continue
-
-        _, conds, effects = action
-
-        # if action_name == 'place' and node.name == 'block5_at_None':
-        #     verbose = True
-        #     # print(f'Main loop')
-        # else:
-        #     verbose = False
-
-        action_params = parse_action_params(action_name, node, target)
-        action_applicable = is_action_applicable(conds, action_params, verbose=verbose)
-
-        robot = action_params.get('robot')
-        robot = cast(Robot, robot)
-
-        if not action_applicable:
-            action_values.append(-1)
-            continue
-
-        if target in goal_nodes.values():
-            action_value += 5
-            action_values.append(action_value)
-            continue
-
-        # Need to look ahead to see if the resulting state enables feasible actions. Maybe consider MCTS
-        if action_name == 'move':
-            if target.values[1] in goal_positions and not robot.gripper_empty and target.values[1].occupied_by is None:
-                action_value += 4
-            elif target.values[1] in current_block_positions and robot.gripper_empty and target.values[1] not in goal_positions:
-                action_value += 2
-            else:
-                action_value += 1
-        elif action_name == 'pick':
-            obj = action_params.get('object')
-            obj = cast(Object, obj)
-            if obj in goal_blocks and robot.gripper_empty:
-                action_value += 3
-
-        tent_state = apply_action(state, conds, action_params, effects)
-        domain.update_state(tent_state)
-        nodes = query_nodes(dtg, tent_state)
-        # print(f"\nTentative nodes: {[n.name for n in nodes]} after action {action_name} on node {node.name} to {target.name}")
-
-        for t_node in nodes:
-            for edge in t_node.edges:
-                tent_action_name, target = edge
-                action = actions.get(tent_action_name)
-
-                if not action:
-                    continue
-
-                _, conds, effects = action
-
-                action_params = parse_action_params(tent_action_name, t_node, target)
-                # if action_name == 'place':
-                #     verbose = True
-                #     print('inner loop')
-                #     # print(f"\nFrom tentative node {t_node.name}, checking action {tent_action_name} to {target.name}, robot at: {tent_state.get(f'{robot.name}_at')}")
-                # else:
-                #     verbose = False
-
-                action_applicable = is_action_applicable(conds, action_params, verbose=verbose)
-                # print(f"From tentative node {t_node.name}, checking action {tent_action_name} to {target.name}, robot at: {tent_state.get(f'{robot.name}_at')}")
-
-                if not action_applicable:
-                    # print(f"From node {node.name}'s tentative node {t_node.name}, cannot do action {tent_action_name} to {target.name}")
-                    continue
-
-                if target in goal_nodes.values():
-                    action_value += 5
-
-                if tent_action_name == 'pick':
-                    action_value += 1
-
-        action_values.append(action_value)
-        domain.states.pop(-1)
-        domain.update_state(state)
-        domain.states.pop(-1)
-    return action_values
-
-def apply_best_action(node_action_values: Dict, current_nodes: List[Node], domain: Domain) -> Tuple[State, List[str]]:
-    valid_node_actions = {k: v for k, v in node_action_values.items() if v[1] >= 0}
-    valid_actions = [av for av in valid_node_actions.values()]
-    new_state = State({})
-    plan = []
-
-    for node_id, action_values in node_action_values.items():
-        print(f"Node: {current_nodes[node_id].name}, Best Action ID: {action_values[0]}, Value: {action_values[1]}")
-
-    while valid_actions:
-        best_node = np.argmax(np.array(valid_actions)[:, 1])
-        best_node_key = list(valid_node_actions.keys())[best_node]
-        action_id = valid_node_actions[best_node_key][0]
-        edge = current_nodes[best_node_key].edges[action_id]
-
-        action_name, target = edge
-        action_params = parse_action_params(action_name, current_nodes[best_node_key], target)
-
-        action = domain.actions.get(action_name)
-        action = cast(Tuple, action)
-        _, conds, effects = action
-
-        action = f"{current_nodes[best_node_key].name} --[{action_name}]--> {target.name}"
-        plan.append(action)
-        print(action)
-        new_state = apply_action(domain.current_state, conds, action_params, effects)
-        if len(domain.states) >= 2:
-            if new_state == domain.states[-2]:
-                print("Reverted to previous state, choosing next best action...\n")
-                valid_actions.pop(best_node)
-                continue
-            else:
-                break
-        else:
-            break
-
-    return new_state, plan
-
-def apply_best_action_selection(node_action_values: Dict, current_nodes: List[Node], domain: Domain) -> Tuple[State, List[str]]:
-    plan = []
-    valid_node_actions = {}
-    new_state = State({})
+from eas.EAS import apply_action_to_state, parse_action_params, query_current_nodes, freeze_state
+from eas.EAS import State, Node, Domain, CanonicalState
+from eas.encoding import EncodedProblem, NONE_CODE, TRUE_CODE
+from mapping.travel_costs import TravelCosts
+from collections import deque
+from typing import Tuple, Dict, cast, List, Set, Deque, Generator
+
+LOOKAHEAD_DISCOUNT = 0.1
+TRAVEL_COST_WEIGHT = 1e-3 # Small enough to only break ties between equally valued actions
+
+class ActionScorer:
+    """
+        Vectorised action values for the greedy planner. Every DTG edge is an operator of an EncodedProblem, so all edges
+        of all current nodes, and the look ahead below them, are scored with array operations on encoded states.
+
+        An edge scores -1 if it is not applicable and 5 if it reaches a goal node. Otherwise it gets an immediate value
+        for the action, plus 5 for every goal-reaching and 1 for every pick action it enables. With a lookahead depth
+        above 1, the best score one level further down is added, discounted by LOOKAHEAD_DISCOUNT. Subtree values are
+        memoised by (encoded state, depth) for the lifetime of the scorer, so each planning step reuses the previous lookahead.
+        With travel costs, every move loses up to TRAVEL_COST_WEIGHT in proportion to its free-space distance, so the
+        shorter of two equally valued moves wins.
+    """
+    def __init__(self, domain: Domain, dtg: Dict[str, Node], goal_nodes: Dict[str, Node], lookahead_depth: int = 1,
+                 travel_costs: TravelCosts | None = None):
+        self.problem = EncodedProblem(domain, dtg)
+        self.lookahead_depth = lookahead_depth
+        self.memo: Dict[Tuple[bytes, int], float] = {}
+
+        problem = self.problem
+        n_values = len(problem.values)
+
+        # Boolean lookups indexed by node ID and by value code (pose and block IDs are value codes)
+        self.goal_node_mask = np.zeros(len(problem.node_names), dtype=bool)
+        self.goal_block_mask = np.zeros(n_values, dtype=bool)
+        self.goal_pose_mask = np.zeros(n_values, dtype=bool)
+        for node_name, g_node in goal_nodes.items():
+            self.goal_node_mask[problem.node_index[node_name]] = True
+            self.goal_block_mask[problem.value_index[g_node.values[1].name]] = True
+            self.goal_pose_mask[problem.value_index[g_node.values[-1].name]] = True
+
+        self.is_move = np.array([action[0] == 'move' for action, _ in problem.operators], dtype=bool)
+        self.is_pick = np.array([action[0] == 'pick' for action, _ in problem.operators], dtype=bool)
+        self.op_pose = np.array([problem.encode_value(params.get('target_pose')) if action[0] == 'move' else NONE_CODE
+                                 for action, params in problem.operators], dtype=np.int64)
+        self.op_object = np.array([problem.encode_value(params.get('object')) if action[0] == 'pick' else NONE_CODE
+                                   for action, params in problem.operators], dtype=np.int64)
+        self.op_travel_cost = self.travel_cost_penalties(travel_costs)
+        self.op_reaches_goal = self.goal_node_mask[problem.op_target_node]
+        self.enabled_weights = 5.0 * self.op_reaches_goal + 1.0 * self.is_pick
+
+        robot = cast(Robot, domain.things.get(Robot, [])[0])
+        self.gripper_col = problem.var_index[f"{robot.name}_gripper_empty"]
+        self.occupied_col = problem.col_of[:, problem.var_name_index['occupied_by']]
+
+        blocks = cast(List[Object], domain.things.get(Object, []))
+        self.block_at_cols = np.array([problem.var_index[f"{block.name}_at"] for block in blocks], dtype=np.int64)
+        # block_goal_at[block, pose code]: whether the block sitting at that pose is a goal node
+        self.block_goal_at = np.zeros((len(blocks), n_values), dtype=bool)
+        for g_node in goal_nodes.values():
+            block_idx = blocks.index(g_node.values[1])
+            self.block_goal_at[block_idx, problem.value_index[g_node.values[-1].name]] = True
+
+    def travel_cost_penalties(self, travel_costs: TravelCosts | None) -> np.ndarray:
+        """
+            Per-operator travel cost of the moves, scaled to [0, TRAVEL_COST_WEIGHT]. Unreachable moves get the full weight.
+        """
+        penalties = np.zeros(len(self.problem.operators))
+        if travel_costs is None:
+            return penalties
+
+        for op, ((action_name, args), _) in enumerate(self.problem.operators):
+            if action_name == 'move':
+                penalties[op] = travel_costs.cost(args[1], args[2])
+
+        reachable = np.isfinite(penalties)
+        max_cost = penalties[reachable].max() if reachable.any() else 0.0
+        penalties[~reachable] = max_cost
+        if max_cost > 0:
+            penalties *= TRAVEL_COST_WEIGHT / max_cost
+
+        return penalties
+
+    def score_matrix(self, state: State, current_nodes: List[Node]) -> np.ndarray:
+        """
+            Scores of the edges of the current nodes as a (nodes, edges) matrix, padded with -inf.
+        """
+        frontier = self.problem.encode(state)[None]
+        op_scores = np.append(self.scores(frontier, self.lookahead_depth)[0], -np.inf)
+        node_ids = [self.problem.node_index[node.name] for node in current_nodes]
+        return op_scores[self.problem.node_ops[node_ids]]
+
+    def scores(self, frontier: np.ndarray, depth: int) -> np.ndarray:
+        """
+            Scores of every operator in every state of the frontier. Operators not on a current (active, non-goal) node are -inf.
+        """
+        problem = self.problem
+        current = (problem.node_active(frontier) & ~self.goal_node_mask)[:, problem.op_node]
+        scores = np.where(current, -1.0, -np.inf)
+
+        rows, ops = np.nonzero(problem.applicable(frontier) & current)
+        if rows.size == 0:
+            return scores
+
+        children = problem.successors(frontier, rows, ops)
+        values = np.where(self.op_reaches_goal[ops], 5.0, self.immediate_values(frontier, rows, ops) + self.enabled_values(children))
+
+        if depth > 1:
+            values += LOOKAHEAD_DISCOUNT * self.subtree_values(children, depth - 1)
+
+        scores[rows, ops] = values
+        return scores
+
+    def immediate_values(self, frontier: np.ndarray, rows: np.ndarray, ops: np.ndarray) -> np.ndarray:
+        gripper_empty = frontier[rows, self.gripper_col] == TRUE_CODE
+
+        pose = self.op_pose[ops]
+        occupied = frontier[rows, self.occupied_col[pose]] != NONE_CODE
+        goal_pose = self.goal_pose_mask[pose]
+        current_block_pose = self.current_block_poses(frontier)[rows, pose]
+
+        move_values = np.where(goal_pose & ~gripper_empty & ~occupied, 4,
+                               np.where(current_block_pose & gripper_empty & ~goal_pose, 2, 1))
+        pick_values = np.where(self.goal_block_mask[self.op_object[ops]] & gripper_empty, 3, 0)
+
+        values = np.where(self.is_move[ops], move_values, np.where(self.is_pick[ops], pick_values, 0)).astype(float)
+        return values - self.op_travel_cost[ops]
+
+    def current_block_poses(self, frontier: np.ndarray) -> np.ndarray:
+        """
+            (states, value codes) mask of the poses holding a block that is not at its goal.
+        """
+        block_poses = frontier[:, self.block_at_cols]
+        not_at_goal = ~self.block_goal_at[np.arange(self.block_at_cols.size), block_poses]
+
+        mask = np.zeros((frontier.shape[0], len(self.problem.values)), dtype=bool)
+        rows, blocks = np.nonzero(not_at_goal)
+        mask[rows, block_poses[rows, blocks]] = True
+        return mask
+
+    def enabled_values(self, frontier: np.ndarray) -> np.ndarray:
+        return self.problem.applicable(frontier).astype(float) @ self.enabled_weights
+
+    def subtree_values(self, frontier: np.ndarray, depth: int) -> np.ndarray:
+        """
+            Best score reachable from each state with a depth-step lookahead, 0 if nothing applies. Memoised.
+        """
+        keys = [(row.tobytes(), depth) for row in frontier]
+        missing = {}
+        for idx, key in enumerate(keys):
+            if key not in self.memo and key not in missing:
+                missing[key] = idx
+
+        if missing:
+            missing_rows = frontier[list(missing.values())]
+            best = np.maximum(self.scores(missing_rows, depth), 0.0).max(axis=1)
+            self.memo.update(zip(missing.keys(), best.tolist()))
+
+        return np.array([self.memo[key] for key in keys])
+
+class PlanNotFound(RuntimeError):
+    """
+        Raised when the greedy search gives up. Carries the actions committed so far and the number of iterations used.
+    """
+    def __init__(self, message: str, partial_plan: List[Tuple[str, List[str]]], iterations: int):
+        super().__init__(message)
+        self.partial_plan = partial_plan
+        self.iterations = iterations
+
+def apply_best_action_selection(score_matrix: np.ndarray, current_nodes: List[Node], domain: Domain,
+                                visited: Set[CanonicalState] | None = None, tabu: Deque[CanonicalState] | None = None) -> Tuple[State, List[str]]:
+    """
+        Apply the highest scoring action, taken by argmax over the (nodes, edges) score matrix, whose resulting state has not
+        been visited yet. If every applicable action leads back to a visited state, fall back to the best one whose state is
+        not in the tabu list of recently visited states. Without a visited set, only a return to the previous state is rejected.
+        Returns an empty state if nothing is left.
+    """
+    scores = np.array(score_matrix, dtype=float)
     current_state = domain.current_state
+    fallback = None
 
-    for k, v in node_action_values.items():
-        # action_value_dict = {f"{a[0]}->{a[1].name}": v for a, v in zip(current_nodes[k].edges, v)}
-        # print(f"Node: {current_nodes[k].name}, Action Values: {action_value_dict}")
-        invalid_actions = np.where(v < 0)[0]
-        if invalid_actions.size == v.size:
-            continue
-
-        valid_node_actions[k] = v
-
-    # for node_id, action_values in valid_node_actions.items():
-        # action_value_dict = {f"{a[0]}->{a[1].name}": v for a, v in zip(current_nodes[node_id].edges, action_values)}
-        # print(f"Node: {current_nodes[node_id].name}, Action Values: {action_value_dict}")
-
-    while valid_node_actions:
-        best_action_value_per_node = np.array([max(v) for v in valid_node_actions.values()])
-        best_node = np.argmax(best_action_value_per_node)
-        best_node_key = list(valid_node_actions.keys())[best_node]
+    if visited is None:
+        visited = set(freeze_state(state) for state in domain.states[-2:-1])
 
-        action_id = np.argmax(valid_node_actions[best_node_key])
+    while scores.size and scores.max() >= 0:
+        best_node_key, action_id = np.unravel_index(np.argmax(scores), scores.shape)
         edge = current_nodes[best_node_key].edges[action_id]
 
         action_name, target = edge
@@ -173,55 +197,80 @@ def apply_best_action_selection(node_action_values: Dict, current_nodes: List[No
         _, conds, effects = action
 
         # action_log = f"{current_nodes[best_node_key].name} --[{action_name}]--> {target.name}"
-        current_node = current_nodes[best_node_key]
-        action = (action_name, [current_node.values[0].name, current_node.values[1].name, target.values[-1].name if target.values[-1] else None])
-        plan.append(action)
-
-        new_state = apply_action(current_state, conds, action_params, effects)
-        if len(domain.states) >= 2:
-            if new_state == domain.states[-2]:
-                print("Reverted to previous state, choosing next best action...\n")
-                valid_node_actions[best_node_key] = np.delete(valid_node_actions[best_node_key], action_id)
-                if not valid_node_actions[best_node_key].tolist():
-                    valid_node_actions.pop(best_node_key)
-
-                continue
-            else:
-                break
-        else:
-            break
-
-    return new_state, plan
-
-def solve_dtg_basic(goal_nodes: Dict[str, Node], dtg: Dict[str, Node], domain: Domain) -> List[Tuple[str, List[str]]]:
-    goal_blocks = [g_node.values[1] for g_node in goal_nodes.values()]
-    goal_positions = [g_node.values[-1] for g_node in goal_nodes.values()]
-    actions_in_domain = domain.actions
+        # Arguments follow the schema parameters so the plan can be replayed, see bind_action_params
+        action = (action_name, [param.name for param in action_params.values()])
+
+        # The score matrix already marks the action as applicable
+        new_state = apply_action_to_state(current_state, action_params, effects)
+        new_state_key = freeze_state(new_state)
+
+        if new_state_key not in visited:
+            return new_state, [action]
+
+        if fallback is None and tabu is not None and new_state_key not in tabu:
+            fallback = (new_state, [action])
+
+        scores[best_node_key, action_id] = -np.inf
+
+    if fallback is not None:
+        print("Every applicable action leads back to a visited state, taking the best one outside the tabu list.")
+        return fallback
+
+    return State({}), []
+
+def solve_dtg_basic(goal_nodes: Dict[str, Node], dtg: Dict[str, Node], domain: Domain, lookahead_depth: int = 1,
+                    max_iterations: int = 500, tabu_tenure: int = 10, travel_costs: TravelCosts | None = None) -> List[Tuple[str, List[str]]]:
+    """
+        Greedy solver: score the edges of the current DTG nodes, commit the best action and repeat until the goal is reached.
+        Raises PlanNotFound when no action is left or the goal is not reached within max_iterations.
+    """
+    return list(iterate_dtg_basic(goal_nodes, dtg, domain, lookahead_depth, max_iterations, tabu_tenure, travel_costs))
+
+def iterate_dtg_basic(goal_nodes: Dict[str, Node], dtg: Dict[str, Node], domain: Domain, lookahead_depth: int = 1,
+                      max_iterations: int = 500, tabu_tenure: int = 10,
+                      travel_costs: TravelCosts | None = None) -> Generator[Tuple[str, List[str]], State | None, None]:
+    """
+        Generator version of solve_dtg_basic that yields every action as soon as it is committed, so execution can
+        start before the plan is complete. Sending an observed state instead of calling next() tells the planner that
+        execution diverged: planning continues from the observed state.
+    """
+    scorer = ActionScorer(domain, dtg, goal_nodes, lookahead_depth, travel_costs)
     actions = []
 
+    visited = {freeze_state(domain.current_state)}
+    tabu = deque(visited, maxlen=tabu_tenure)
+    iterations = 0
+
     while not domain.goal_reached:
+        if iterations >= max_iterations:
+            raise PlanNotFound(f"Goal not reached within {max_iterations} iterations", actions, iterations)
+        iterations += 1
+
         current_state = domain.current_state
         current_nodes = query_current_nodes(dtg, current_state, goal_nodes)
-        current_block_positions = [node.values[-1] for node in current_nodes if type(node.values[1]) == Object]
-
-        node_action_values = {}
         # print(f"Current nodes: {[node.name for node in current_nodes]}")
 
-        for node_id, node in enumerate(current_nodes):
-            action_values = compute_action_values(domain, current_state, dtg, node, goal_nodes, actions_in_domain,
-                                                  current_block_positions, goal_blocks, goal_positions)
+        score_matrix = scorer.score_matrix(current_state, current_nodes)
+        new_state, new_actions = apply_best_action_selection(score_matrix, current_nodes, domain, visited, tabu)
 
-            node_action_values[node_id] = np.array(action_values)
-            # node_action_values[node_id] = (np.argmax(np.array(action_values)), max(action_values))
+        if not new_state:
+            raise PlanNotFound(f"No applicable action left after {iterations} iterations", actions, iterations)
 
-        # new_state, new_actions = apply_best_action(node_action_values, current_nodes, domain)
-        new_state, new_actions = apply_best_action_selection(node_action_values, current_nodes, domain)
         actions.extend(new_actions)
+        new_state_key = freeze_state(new_state)
+        visited.add(new_state_key)
+        tabu.append(new_state_key)
 
         # time.sleep(0.1)
-        if new_state:
-            domain.update_state(new_state)
-            # print(new_state)
+        domain.update_state(new_state)
+        # print(new_state)
+
+        for action in new_actions:
+            observed_state = yield action
+            if observed_state is not None:
+                print("Execution diverged from the plan, replanning from the observed state.")
+                domain.update_state(observed_state)
+                tabu.append(freeze_state(observed_state))
+                break
 
     print("Goal reached!")
-    return actions
\ No newline at end of file
@@ -0,0 +1,298 @@
+import math
+import random
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, List, Tuple, cast
+
+from eas.block_domain import create_goal_nodes
+from eas.EAS import Action, State, Node, Domain, Condition, Effect
+from eas.EAS import apply_action_to_state, freeze_state
+from planners.basic_planner import ActionScorer, PlanNotFound
+
+rollout_policies = Enum('RolloutPolicy', 'RANDOM HEURISTIC')
+ROLLOUT_EPSILON = 0.1 # Chance of a random step in heuristic rollouts
+
+ActionSchemas = Dict[str, Tuple[Dict, List[Condition], List[Effect]]]
+
+@dataclass(eq=False)
+class MCTSNode:
+    state: State
+    parent: 'MCTSNode | None' = None
+    action: Action | None = None # Action leading from the parent to this node
+    children: List['MCTSNode'] = field(default_factory=list)
+    untried: List[Tuple[Action, Dict[str, str]]] | None = None # Applicable actions not expanded yet, filled on first visit
+    visits: int = 0
+    value_sum: float = 0.0
+    is_goal: bool = False
+
+    @property
+    def value(self) -> float:
+        return self.value_sum / self.visits if self.visits else 0.0
+
+class MCTSPlanner:
+    """
+        UCT search over the grounded DTG actions. Nodes only expand the few actions the greedy planner values most, and
+        rollouts follow the same values. Rollouts are run in batches on encoded states, optionally split over a process pool
+        with one slice of the batch per worker, and the search tree is kept between execution steps: after committing an
+        action the chosen child becomes the new root.
+    """
+    def __init__(self, domain: Domain, dtg: Dict[str, Node], rollout_budget: int = 200, batch_size: int = 64,
+                 num_workers: int = 0, rollout_policy: rollout_policies = rollout_policies.HEURISTIC,
+                 max_rollout_depth: int = 40, exploration: float = 1.4, max_children: int = 4, seed: int | None = None):
+        self.domain = domain
+        self.dtg = dtg
+        self.rollout_budget = rollout_budget
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.rollout_policy = rollout_policy
+        self.max_rollout_depth = max_rollout_depth
+        self.exploration = exploration
+        self.max_children = max_children
+        self.rng = random.Random(seed)
+
+        self.action_schemas = cast(ActionSchemas, domain.actions)
+        self.goal_state = domain.goal_state
+        self.root = MCTSNode(state=domain.current_state)
+
+        # Rollouts run on the integer encoding and are guided by the greedy planner's action values
+        self.scorer = ActionScorer(domain, dtg, create_goal_nodes(domain, dtg))
+        self.goal_cols, self.goal_vals = self.scorer.problem.encode_goal(self.goal_state)
+
+        self.total_rollouts = 0
+        self.pool: ProcessPoolExecutor | None = None
+
+        if self.num_workers > 0:
+            self.pool = ProcessPoolExecutor(max_workers=self.num_workers, initializer=init_rollout_worker,
+                                            initargs=(self.scorer, self.goal_cols, self.goal_vals,
+                                                      self.max_rollout_depth, self.rollout_policy))
+
+    def __enter__(self) -> 'MCTSPlanner':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def solve(self, max_steps: int = 200) -> List[Action]:
+        """
+            Execution loop in the style of solve_dtg_basic: search, commit the best action, update the domain, repeat.
+            Raises PlanNotFound with the committed actions when no action is left or the goal is not reached within max_steps.
+        """
+        plan = []
+        visited = {freeze_state(self.root.state)}
+
+        for step in range(max_steps):
+            if self.domain.goal_reached:
+                print("Goal reached!")
+                return plan
+
+            self.search()
+            child = self.best_child(visited)
+            if child is None:
+                raise PlanNotFound(f"No applicable action left after {step} steps", plan, step)
+
+            action = cast(Action, child.action)
+            plan.append(action)
+            visited.add(freeze_state(child.state))
+
+            self.domain.update_state(child.state)
+            self.advance(action)
+
+        if not self.domain.goal_reached:
+            raise PlanNotFound(f"Goal not reached within {max_steps} steps", plan, max_steps)
+
+        print("Goal reached!")
+        return plan
+
+    def search(self, rollout_budget: int | None = None) -> MCTSNode:
+        budget = self.rollout_budget if rollout_budget is None else rollout_budget
+        done = 0
+
+        while done < budget:
+            batch_size = min(self.batch_size, budget - done)
+            leaves = [self.select_and_expand() for _ in range(batch_size)]
+
+            rollout_states = [leaf.state for leaf in leaves if not leaf.is_goal]
+            rewards = iter(self.run_rollouts(rollout_states))
+
+            for leaf in leaves:
+                reward = goal_reward(0, self.max_rollout_depth) if leaf.is_goal else next(rewards)
+                self.backpropagate(leaf, reward)
+
+            done += batch_size
+            self.total_rollouts += batch_size
+
+        return self.root
+
+    def run_rollouts(self, states: List[State]) -> List[float]:
+        """
+            Rollouts from the given states, encoded into one frontier. With a pool, every worker gets a single slice of
+            the batch and one seed, and steps its rollouts together against the problem it received at start up.
+        """
+        if not states:
+            return []
+
+        frontier = np.array([self.scorer.problem.encode(state) for state in states])
+
+        if self.pool is None:
+            return batch_rollouts(frontier, self.rng.randrange(2**31), self.scorer, self.goal_cols, self.goal_vals,
+                                  self.max_rollout_depth, self.rollout_policy).tolist()
+
+        chunks = np.array_split(frontier, min(self.num_workers, len(states)))
+        seeds = [self.rng.randrange(2**31) for _ in chunks]
+        return np.concatenate(list(self.pool.map(worker_rollouts, chunks, seeds))).tolist()
+
+    def select_and_expand(self) -> MCTSNode:
+        # Visits are counted on the way down, so the other selections of the same batch spread out over the tree
+        node = self.root
+        node.visits += 1
+
+        while True:
+            if node.is_goal:
+                return node
+
+            if node.untried is None:
+                node.untried = self.candidate_operators(node.state)
+
+            if node.untried:
+                action, params = node.untried.pop()
+                _, _, effects = self.action_schemas[action[0]]
+                child_state = apply_action_to_state(node.state, params, effects)
+                child = MCTSNode(state=child_state, parent=node, action=action, visits=1,
+                                 is_goal=goal_satisfaction(child_state, self.goal_state) == 1.0)
+                node.children.append(child)
+                return child
+
+            if not node.children:
+                return node
+
+            node = self.uct_child(node)
+            node.visits += 1
+
+    def candidate_operators(self, state: State) -> List[Tuple[Action, Dict[str, str]]]:
+        """
+            The max_children applicable operators the greedy planner's ActionScorer values most, ties broken at random,
+            ordered so that popping from the end expands the best one first.
+        """
+        problem = self.scorer.problem
+        scores = self.scorer.scores(problem.encode(state)[None], 1)[0]
+        ops = np.flatnonzero(scores > -1.0).tolist()
+        self.rng.shuffle(ops)
+        ops.sort(key=lambda op: -scores[op])
+
+        return [problem.operators[op] for op in reversed(ops[:self.max_children])]
+
+    def uct_child(self, node: MCTSNode) -> MCTSNode:
+        log_visits = math.log(max(node.visits, 1))
+        scores = [child.value + self.exploration * math.sqrt(log_visits / max(child.visits, 1)) for child in node.children]
+        return node.children[int(np.argmax(scores))]
+
+    def backpropagate(self, node: MCTSNode, reward: float) -> None:
+        # Visits were already counted in select_and_expand
+        current: MCTSNode | None = node
+        while current is not None:
+            current.value_sum += reward
+            current = current.parent
+
+    def best_child(self, visited: set | None = None) -> MCTSNode | None:
+        children = self.root.children
+        if visited is not None:
+            unvisited = [child for child in children if freeze_state(child.state) not in visited]
+            children = unvisited or children
+
+        if not children:
+            return None
+
+        return max(children, key=lambda child: (child.visits, child.value))
+
+    def advance(self, action: Action) -> MCTSNode:
+        """
+            Re-root the tree at the child reached by the executed action, keeping its subtree and statistics.
+        """
+        for child in self.root.children:
+            if child.action == action:
+                child.parent = None
+                self.root = child
+                return self.root
+
+        self.root = MCTSNode(state=self.domain.current_state)
+        return self.root
+
+# Rollout state lives at module level so that pool workers receive the problem once through the initializer
+# and keep it for every batch they are sent afterwards
+_rollout_context: Dict[str, Any] = {}
+
+def init_rollout_worker(scorer: ActionScorer, goal_cols: np.ndarray, goal_vals: np.ndarray,
+                        max_rollout_depth: int, rollout_policy: rollout_policies) -> None:
+    _rollout_context['scorer'] = scorer
+    _rollout_context['goal_cols'] = goal_cols
+    _rollout_context['goal_vals'] = goal_vals
+    _rollout_context['max_rollout_depth'] = max_rollout_depth
+    _rollout_context['rollout_policy'] = rollout_policy
+
+def worker_rollouts(frontier: np.ndarray, seed: int) -> np.ndarray:
+    return batch_rollouts(frontier, seed, _rollout_context['scorer'], _rollout_context['goal_cols'], _rollout_context['goal_vals'],
+                          _rollout_context['max_rollout_depth'], _rollout_context['rollout_policy'])
+
+def goal_satisfaction(state: State, goal_state: State) -> float:
+    if not goal_state:
+        return 1.0
+
+    satisfied = sum(1 for var, val in goal_state.items() if state.get(var) == val)
+    return satisfied / len(goal_state)
+
+def goal_reward(steps: int, max_rollout_depth: int) -> float:
+    # Reaching the goal is always worth more than any partial progress, and sooner is better
+    return 2.0 - steps / (max_rollout_depth + 1)
+
+def batch_rollouts(frontier: np.ndarray, seed: int, scorer: ActionScorer, goal_cols: np.ndarray, goal_vals: np.ndarray,
+                   max_rollout_depth: int, rollout_policy: rollout_policies) -> np.ndarray:
+    """
+        One rollout from every encoded state of the frontier, all stepped together. The heuristic policy takes the operator
+        the greedy planner's ActionScorer values most, ties broken at random, and a random applicable one with probability
+        ROLLOUT_EPSILON. Rollouts reaching the goal get goal_reward, the others their fraction of satisfied goal variables.
+    """
+    rng = np.random.default_rng(seed)
+    problem = scorer.problem
+    states = frontier.copy()
+    rewards = np.zeros(states.shape[0])
+    running = np.ones(states.shape[0], dtype=bool)
+    reached = np.zeros(states.shape[0], dtype=bool)
+
+    for step in range(max_rollout_depth + 1):
+        at_goal = running & np.all(states[:, goal_cols] == goal_vals, axis=1)
+        rewards[at_goal] = goal_reward(step, max_rollout_depth)
+        reached |= at_goal
+        running &= ~at_goal
+
+        if step == max_rollout_depth or not running.any():
+            break
+
+        rows = np.flatnonzero(running)
+        scores = scorer.scores(states[rows], 1)
+        # Inapplicable operators score -1, operators off the current nodes -inf
+        applicable = scores > -1.0
+
+        stuck = ~applicable.any(axis=1)
+        running[rows[stuck]] = False
+        rows, scores, applicable = rows[~stuck], scores[~stuck], applicable[~stuck]
+        if rows.size == 0:
+            break
+
+        noise = rng.random(scores.shape)
+        explore = rng.random(rows.size) < ROLLOUT_EPSILON
+        if rollout_policy == rollout_policies.RANDOM:
+            explore[:] = True
+
+        keys = np.where(explore[:, None], np.where(applicable, noise, -np.inf), scores + 1e-6 * noise)
+        states[rows] = problem.successors(states, rows, keys.argmax(axis=1))
+
+    rewards[~reached] = np.mean(states[~reached][:, goal_cols] == goal_vals, axis=1) if goal_cols.size else 1.0
+    return rewards
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+
+from typing import Dict, List, Tuple
+
+from eas.EAS import Action, State, freeze_state, replay_plan, goal_holds
+
+PLAN_LIBRARY_VERSION = 1
+
+ActionSchemas = Dict[str, Tuple[Dict, List, List]]
+
+def problem_key(state: State, goal_state: State) -> str:
+    """
+        Canonical hash of a (state, goal) pair. Variables are sorted, so the key does not depend on dict order.
+    """
+    goal_items = tuple(sorted(goal_state.items()))
+    return hashlib.sha1(repr((freeze_state(state), goal_items)).encode()).hexdigest()
+
+class PlanLibrary:
+    """
+        Persistent cache of solved problems. Every stored plan also indexes all of its suffixes by the state they
+        start from, so a search that reaches a state some earlier plan passed through can finish with that plan's tail.
+        Cached plans are replayed symbolically before they are returned and dropped if they no longer reach the goal.
+    """
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.plans: Dict[str, List[Action]] = {} # problem key -> plan
+        self.fragments: Dict[str, Tuple[str, int]] = {} # sub-state key -> (problem key, index of the first action of the suffix)
+        self.hits = 0
+        self.misses = 0
+
+        if self.path is not None and os.path.exists(self.path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self.plans)
+
+    def lookup(self, state: State, goal_state: State, actions: ActionSchemas) -> List[Action] | None:
+        key = problem_key(state, goal_state)
+        plan = self.plans.get(key)
+
+        if plan is None:
+            self.misses += 1
+            return None
+
+        if not self.replays_to_goal(state, goal_state, plan, actions):
+            self.evict(key)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return list(plan)
+
+    def lookup_suffix(self, state: State, goal_state: State, actions: ActionSchemas) -> List[Action] | None:
+        """
+            Plan suffix leading from an intermediate state to the goal, taken from any stored plan that passed through it.
+        """
+        fragment = self.fragments.get(problem_key(state, goal_state))
+        if fragment is None or fragment[0] not in self.plans:
+            return None
+
+        plan_key, start = fragment
+        suffix = self.plans[plan_key][start:]
+        if not self.replays_to_goal(state, goal_state, suffix, actions):
+            del self.fragments[problem_key(state, goal_state)]
+            return None
+
+        return list(suffix)
+
+    def store(self, state: State, goal_state: State, plan: List[Action], actions: ActionSchemas) -> bool:
+        """
+            Add a plan that solves the problem from state. Invalid plans are rejected, and an existing plan
+            for the same problem is only replaced by a shorter one, together with the suffixes indexed for it.
+            Returns whether the plan was stored.
+        """
+        states = replay_plan(state, plan, actions)
+        if states is None or not goal_holds(states[-1], goal_state):
+            return False
+
+        key = problem_key(state, goal_state)
+        if key in self.plans and len(self.plans[key]) <= len(plan):
+            return False
+
+        if key in self.plans:
+            # The suffixes indexed for the old plan point at its action indices
+            self.evict(key)
+
+        self.plans[key] = [Action((action_name, list(args))) for action_name, args in plan]
+
+        for start, sub_state in enumerate(states[:-1]):
+            sub_key = problem_key(sub_state, goal_state)
+            fragment = self.fragments.get(sub_key)
+            if fragment is None or fragment[0] not in self.plans or \
+               len(self.plans[fragment[0]]) - fragment[1] > len(plan) - start:
+                self.fragments[sub_key] = (key, start)
+
+        return True
+
+    def evict(self, key: str) -> None:
+        """
+            Drop a stored plan together with the suffix fragments that point into it.
+        """
+        self.plans.pop(key, None)
+        self.fragments = {sub_key: fragment for sub_key, fragment in self.fragments.items() if fragment[0] != key}
+
+    def replays_to_goal(self, state: State, goal_state: State, plan: List[Action], actions: ActionSchemas) -> bool:
+        try:
+            states = replay_plan(state, plan, actions)
+        except ValueError:
+            return False
+
+        return states is not None and goal_holds(states[-1], goal_state)
+
+    def save(self, path: str | None = None) -> None:
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path given to save the plan library to")
+
+        data = {'version': PLAN_LIBRARY_VERSION,
+                'plans': self.plans,
+                'fragments': {sub_key: list(fragment) for sub_key, fragment in self.fragments.items()}}
+
+        # Write to a temporary file first so an interrupted save does not corrupt the library
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str | None = None) -> None:
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path given to load the plan library from")
+
+        with open(path, 'r') as f:
+            data = json.load(f)
+
+        if data.get('version') != PLAN_LIBRARY_VERSION:
+            raise ValueError(f"Unsupported plan library version {data.get('version')} in {path}")
+
+        self.plans = {key: [Action((action_name, args)) for action_name, args in plan] for key, plan in data['plans'].items()}
+        self.fragments = {sub_key: (plan_key, start) for sub_key, (plan_key, start) in data['fragments'].items()}
@@ -0,0 +1,99 @@
+import math
+
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Tuple, cast
+
+from eas.EAS import Action, State, Domain, freeze_state, replay_plan, goal_holds
+from eas.block_domain import Pose
+
+@dataclass
+class PlanReport:
+    actions_before: int
+    actions_after: int
+    distance_before: float
+    distance_after: float
+
+    def __str__(self) -> str:
+        action_reduction = 1 - self.actions_after / self.actions_before if self.actions_before else 0.0
+        distance_reduction = 1 - self.distance_after / self.distance_before if self.distance_before else 0.0
+        return (f"Plan optimised: {self.actions_before} -> {self.actions_after} actions ({action_reduction:.0%} fewer), "
+                f"travel distance {self.distance_before:.2f} -> {self.distance_after:.2f} ({distance_reduction:.0%} shorter)")
+
+def optimize_plan(plan: List[Action], domain: Domain, start_state: State | None = None) -> Tuple[List[Action], PlanReport]:
+    """
+        Shorten a plan with local rewrites until none applies: drop stretches that return to an earlier state,
+        drop pick/place pairs that put a block back where it was picked, and fuse consecutive moves.
+        Every rewrite is only kept if the rewritten plan still replays from start_state to the goal.
+    """
+    start_state = domain.states[0] if start_state is None else start_state
+    if not reaches_goal(plan, start_state, domain):
+        raise ValueError("Plan does not reach the goal from the start state, it cannot be optimised")
+
+    optimized = [Action((action_name, list(args))) for action_name, args in plan]
+
+    changed = True
+    while changed:
+        changed = False
+        states = cast(List[State], replay_plan(start_state, optimized, domain.actions))
+
+        for candidate in rewrite_candidates(optimized, states):
+            if reaches_goal(candidate, start_state, domain):
+                optimized = candidate
+                changed = True
+                break
+
+    report = PlanReport(actions_before=len(plan), actions_after=len(optimized),
+                        distance_before=travel_distance(plan, domain), distance_after=travel_distance(optimized, domain))
+
+    return optimized, report
+
+def rewrite_candidates(plan: List[Action], states: List[State]) -> Iterator[List[Action]]:
+    # Cycles: the state after plan[j - 1] equals the state before plan[i], so plan[i:j] does nothing
+    first_seen: Dict = {}
+    for idx, state in enumerate(states):
+        key = freeze_state(state)
+        if key in first_seen:
+            yield plan[:first_seen[key]] + plan[idx:]
+        else:
+            first_seen[key] = idx
+
+    # A block picked up and put back on the same pose, with only moves in between
+    for i, (action_name, args) in enumerate(plan):
+        if action_name != 'pick':
+            continue
+
+        for j in range(i + 1, len(plan)):
+            if plan[j][0] == 'place' and plan[j][1] == args:
+                yield plan[:i] + plan[i + 1:j] + plan[j + 1:]
+            if plan[j][0] != 'move':
+                break
+
+    # Consecutive moves: move(a, b), move(b, c) becomes move(a, c), or nothing when c is a
+    for i in range(len(plan) - 1):
+        (name_a, args_a), (name_b, args_b) = plan[i], plan[i + 1]
+        if name_a != 'move' or name_b != 'move' or args_a[0] != args_b[0]:
+            continue
+
+        robot, start_pose, target_pose = args_a[0], args_a[1], args_b[2]
+        fused = [] if start_pose == target_pose else [Action(('move', [robot, start_pose, target_pose]))]
+        yield plan[:i] + fused + plan[i + 2:]
+
+def reaches_goal(plan: List[Action], start_state: State, domain: Domain) -> bool:
+    try:
+        states = replay_plan(start_state, plan, domain.actions)
+    except ValueError:
+        return False
+
+    return states is not None and goal_holds(states[-1], domain.goal_state)
+
+def travel_distance(plan: List[Action], domain: Domain) -> float:
+    distance = 0.0
+    for action_name, args in plan:
+        if action_name != 'move':
+            continue
+
+        start_pose = cast(Pose, domain.name_things[args[1]])
+        target_pose = cast(Pose, domain.name_things[args[2]])
+        distance += math.dist(start_pose.pos, target_pose.pos)
+
+    return distance
@@ -0,0 +1,139 @@
+import numpy as np
+
+from typing import Dict, List, Tuple
+
+from eas.EAS import Action, State, Node, Domain, replay_plan, goal_holds
+from eas.encoding import EncodedProblem
+from planners.basic_planner import PlanNotFound
+
+class PlanRepairer:
+    """
+        Repairs a plan after execution diverged from it, reusing the grounded DTG between repairs.
+        The states the plan was expected to pass through after the divergence are rejoin points: a breadth-first
+        search from the observed state stops at the first layer that reaches one of them (or the goal) and the
+        repaired plan is the path found followed by the rest of the original plan. Successor expansions are cached
+        per state, so repeated repairs around the same plan only expand states they have not seen before.
+        States are identified by their encoded row bytes, never by a hash alone.
+    """
+    def __init__(self, domain: Domain, dtg: Dict[str, Node], max_depth: int = 12):
+        self.domain = domain
+        self.max_depth = max_depth
+
+        self.problem = EncodedProblem(domain, dtg)
+        self.goal_cols, self.goal_vals = self.problem.encode_goal(domain.goal_state)
+        self.expanded: Dict[bytes, Tuple[np.ndarray, np.ndarray]] = {} # row bytes -> (successor rows, operator IDs)
+
+    def repair(self, plan: List[Action], observed_state: State, divergence_index: int,
+               start_state: State | None = None) -> List[Action] | None:
+        """
+            Repaired plan suffix from observed_state, the state found after executing plan[:divergence_index].
+            The expected states are replayed from start_state, by default the domain's initial state.
+            Raises PlanNotFound if no repair is found within max_depth actions, or if the repaired plan
+            does not replay from observed_state to the goal.
+        """
+        start_state = self.domain.states[0] if start_state is None else start_state
+        expected_states = replay_plan(start_state, plan, self.domain.actions)
+        if expected_states is None:
+            raise ValueError("Plan is not executable from the start state, it cannot be repaired")
+
+        # Later rejoin points win, they leave less of the original plan to execute
+        rejoin_points: Dict[bytes, int] = {}
+        for index in range(divergence_index, len(expected_states)):
+            rejoin_points[self.problem.encode(expected_states[index]).tobytes()] = index
+
+        rejoin_rows = np.array([np.frombuffer(key, dtype=np.int64) for key in rejoin_points])
+        rejoin_keys = self.problem.row_keys(rejoin_rows)
+
+        frontier = self.problem.encode(observed_state)[None]
+        frontier_keys = self.problem.row_keys(frontier)
+        seen = frontier_keys
+        layers: List[Tuple[np.ndarray, np.ndarray]] = [] # (parent rows, operator IDs) per depth
+
+        for depth in range(self.max_depth + 1):
+            remaining = np.full(frontier.shape[0], np.inf)
+
+            is_goal = np.all(frontier[:, self.goal_cols] == self.goal_vals, axis=1)
+            remaining[is_goal] = 0
+
+            matches = np.flatnonzero(np.isin(frontier_keys, rejoin_keys))
+            for row in matches:
+                index = rejoin_points[frontier[row].tobytes()]
+                remaining[row] = min(remaining[row], len(plan) - index)
+
+            if np.isfinite(remaining).any():
+                row = int(np.argmin(remaining))
+                repaired = self.trace_back(layers, row) + self.rejoin_suffix(plan, rejoin_points, frontier[row], remaining[row])
+                self.check_repair(observed_state, repaired)
+                return repaired
+
+            if depth == self.max_depth:
+                break
+
+            children, parents, ops = self.expand(frontier)
+            if not children.shape[0]:
+                break
+
+            child_keys = self.problem.row_keys(children)
+            _, first = np.unique(child_keys, return_index=True)
+            first = np.sort(first[~np.isin(child_keys[first], seen)])
+            if not first.size:
+                break
+
+            layers.append((parents[first], ops[first]))
+            frontier, frontier_keys = children[first], child_keys[first]
+            seen = np.union1d(seen, frontier_keys)
+
+        raise PlanNotFound(f"No repair within {self.max_depth} actions", [], depth)
+
+    def check_repair(self, observed_state: State, repaired: List[Action]) -> None:
+        try:
+            states = replay_plan(observed_state, repaired, self.domain.actions)
+        except ValueError:
+            states = None
+
+        if states is None or not goal_holds(states[-1], self.domain.goal_state):
+            raise PlanNotFound("Repaired plan does not reach the goal from the observed state", repaired, len(repaired))
+
+    def expand(self, frontier: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+            Successors of every frontier row as (children, parent rows, operator IDs), taken from the cache where possible.
+        """
+        row_keys = [row.tobytes() for row in frontier]
+        missing = np.array([key not in self.expanded for key in row_keys], dtype=bool)
+
+        if missing.any():
+            missing_rows = np.flatnonzero(missing)
+            unexpanded = frontier[missing_rows]
+
+            applicable = self.problem.node_active(unexpanded)[:, self.problem.op_node] & self.problem.applicable(unexpanded)
+            rows, ops = np.nonzero(applicable)
+            children = self.problem.successors(unexpanded, rows, ops)
+
+            bounds = np.searchsorted(rows, np.arange(unexpanded.shape[0] + 1))
+            for k, row in enumerate(missing_rows):
+                self.expanded[row_keys[row]] = (children[bounds[k]:bounds[k + 1]], ops[bounds[k]:bounds[k + 1]])
+
+        all_children, all_parents, all_ops = [], [], []
+        for row, key in enumerate(row_keys):
+            children, ops = self.expanded[key]
+            all_children.append(children)
+            all_parents.append(np.full(ops.size, row, dtype=np.int64))
+            all_ops.append(ops)
+
+        return np.concatenate(all_children), np.concatenate(all_parents), np.concatenate(all_ops)
+
+    def trace_back(self, layers: List[Tuple[np.ndarray, np.ndarray]], row: int) -> List[Action]:
+        actions = []
+        for parents, ops in reversed(layers):
+            action, _ = self.problem.operators[int(ops[row])]
+            actions.insert(0, action)
+            row = int(parents[row])
+
+        return actions
+
+    def rejoin_suffix(self, plan: List[Action], rejoin_points: Dict[bytes, int], row: np.ndarray, remaining: float) -> List[Action]:
+        key = row.tobytes()
+        if remaining == 0 or key not in rejoin_points:
+            return []
+
+        return plan[rejoin_points[key]:]
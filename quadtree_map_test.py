@@ -0,0 +1,52 @@
+import time
+import tracemalloc
+import numpy as np
+
+from eas.block_domain import create_block_domain
+from eas.eas_parser import parse_configs
+from mapping.oc_map import OccupancyGridMap
+from mapping.quadtree_map import QuadTreeMap, pyramid_leaves, morton_codes
+
+def main():
+    problem_config_path = "config/problem_configs/"
+
+    for config_name in ["simple", "stack_2_stack", "many_stacked"]:
+        block_domain = parse_configs(create_block_domain(), config_name, problem_config_path, verbose=False)
+
+        # A margin that is not a multiple of the resolution puts footprint borders inside cells
+        for grid_res, col_margin in [(0.1, 1.0), (0.1, 0.73), (0.25, 1.3)]:
+            ocm = OccupancyGridMap(block_domain, grid_res=grid_res, col_margin=col_margin)
+            quadtree = QuadTreeMap(ocm)
+            assert ocm.grid_size is None
+
+            # Reference: the same quadtree merged bottom-up from the dense map
+            ocm.create_occupancy_grid_map()
+            _, (x0, y0, level, occupied) = pyramid_leaves(ocm.occupancy)
+            order = np.argsort(morton_codes(x0, y0))
+
+            assert np.array_equal(quadtree.x0, x0[order]) and np.array_equal(quadtree.y0, y0[order])
+            assert np.array_equal(quadtree.size, 1 << level[order])
+            assert np.array_equal(quadtree.occupied, occupied[order])
+            print(f"{config_name}, res {grid_res}, margin {col_margin}: {len(quadtree.codes)} leaves match the dense build")
+
+    # A fine grid whose dense map alone would be 100 MB
+    block_domain = parse_configs(create_block_domain(), "stack_2_stack", problem_config_path, verbose=False)
+    ocm = OccupancyGridMap(block_domain, grid_res=0.02, col_margin=1.0)
+    nx_cells, ny_cells = ocm.compute_grid_size()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    quadtree = QuadTreeMap(ocm)
+    build_time = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    path = quadtree.path((-1.0, -1.0), (3.0, 2.0))
+    print(f"{nx_cells}x{ny_cells} cells: {len(quadtree.codes)} leaves in {build_time:.2f}s, peak {peak / 1e6:.1f} MB, "
+          f"path of {len(path)} points")
+
+    assert len(path) > 0
+    assert peak < nx_cells * ny_cells / 2
+
+if __name__ == "__main__":
+    main()